@@ -0,0 +1,15 @@
+CREATE TABLE IF NOT EXISTS alerts (
+    id SERIAL PRIMARY KEY,
+    rule_name VARCHAR(50) NOT NULL,
+    sensor_id INTEGER NOT NULL,
+    level VARCHAR(16) NOT NULL,
+    message TEXT NOT NULL,
+    value FLOAT,
+    opened_at TIMESTAMP NOT NULL,
+    closed_at TIMESTAMP
+);
+
+-- 只索引未关闭的告警，API 直接从这里读取
+CREATE INDEX IF NOT EXISTS idx_alerts_open
+    ON alerts (sensor_id, opened_at DESC)
+    WHERE closed_at IS NULL;
\ No newline at end of file
@@ -0,0 +1,9 @@
+-- 入库幂等：同一传感器同一时刻只保留一条（先清理建约束之前已写入的重复行）
+DELETE FROM rawdata_from_sensors a
+ USING rawdata_from_sensors b
+ WHERE a.sensor_id = b.sensor_id
+   AND a.time_stamp = b.time_stamp
+   AND a.id > b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_rawdata_sensor_time
+    ON rawdata_from_sensors (sensor_id, time_stamp);
\ No newline at end of file
@@ -4,45 +4,182 @@
 
 # src/calc.py
 
-from flask import Flask, jsonify
-import psycopg2
+import os
+import threading
+
+from flask import Flask, jsonify, request, send_from_directory
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
 from datetime import datetime, timedelta
 
 # 使用你已有的 config.py。它在模块底部实例化了一个名为 config 的对象
 from config import config
+import downsample
+import fleet
+import health
+import liveness
+from rules import parse_timestamp
+
+class App(Flask):
+    def get_send_file_max_age(self, filename):
+        # HTML 页面不带版本号，max_age=0 让浏览器每次用 ETag 重新验证，页面更新能立即生效；
+        # 其余静态资源使用长期缓存
+        if filename and filename.endswith(".html"):
+            return 0
+        return super().get_send_file_max_age(filename)
+
+app = App(__name__)
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = config.STATIC_MAX_AGE
+
+# 每个进程一个连接池：gunicorn fork 出的 worker 各自建池，互不共享
+_db_pool = None
+_db_pool_pid = None
+_db_pool_lock = threading.Lock()
+# 与连接池同样大小的信号量：池用完时 ThreadedConnectionPool.getconn() 会直接抛 PoolError，
+# 而开发服务器每个请求一个线程、数量不设上限，所以先在信号量上排队，再取连接
+_db_slots = None
 
-app = Flask(__name__)
+def get_db_pool():
+    global _db_pool, _db_pool_pid, _db_slots
+    with _db_pool_lock:
+        if _db_pool is None or _db_pool_pid != os.getpid():
+            _db_pool = ThreadedConnectionPool(
+                1,
+                config.API_DB_POOL_SIZE,
+                host     = config.DB_HOST,
+                port     = config.DB_PORT,
+                dbname   = config.DB_NAME,
+                user     = config.DB_USER,
+                password = config.DB_PASSWORD
+            )
+            _db_slots = threading.BoundedSemaphore(config.API_DB_POOL_SIZE)
+            _db_pool_pid = os.getpid()
+    return _db_pool
 
-def get_db_cursor():
+def get_db_cursor(timeout=None):
     """
-    建立一个 psycopg2 连接，并返回 (conn, cursor)。
+    从本进程的连接池取一个连接，并返回 (conn, cursor)，用完调用 release_db_cursor()。
+    连接全部被占用时阻塞等待（最多 timeout 秒，超时抛 TimeoutError）。
     采用 RealDictCursor，fetchall()/fetchone() 直接返回 dict，方便 jsonify。
     """
-    conn = psycopg2.connect(
-        host     = config.DB_HOST,
-        port     = config.DB_PORT,
-        dbname   = config.DB_NAME,
-        user     = config.DB_USER,
-        password = config.DB_PASSWORD
-    )
-    conn.autocommit = True
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    pool = get_db_pool()
+    if not _db_slots.acquire(timeout=timeout):
+        raise TimeoutError("数据库连接池已满")
+    conn = None
+    try:
+        conn = pool.getconn()
+        conn.autocommit = True
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+    except Exception:
+        if conn is not None:
+            pool.putconn(conn)
+        _db_slots.release()
+        raise
     return conn, cur
 
+def release_db_cursor(conn, cur):
+    cur.close()
+    get_db_pool().putconn(conn)
+    _db_slots.release()
+
+# 降采样结果缓存（进程内）；只缓存已经结束的时间窗口
+history_cache = downsample.HistoryCache(config.HISTORY_CACHE_SIZE)
+
+def downsampled_history(cur, sid, start, end, points, method):
+    """
+    取 [start, end] 内该传感器的全部记录，按 metric 分别降采样到 points 个点。
+    end 为 None 时不设上限，窗口一直延伸到最新写入的读数。
+    时间戳与 rules.parse_timestamp 一样是服务器本地的 naive 时间，因此与 datetime.now() 比较：
+    显式给出且早于 now - HISTORY_IMMUTABLE_AFTER 的窗口不会再变化，结果可以缓存。
+    """
+    cacheable = end is not None and \
+        (datetime.now() - end).total_seconds() > config.HISTORY_IMMUTABLE_AFTER
+    key = (sid, start, end, points, method)
+    if cacheable:
+        cached = history_cache.get(key)
+        if cached is not None:
+            return cached
+
+    upper_bound = "AND time_stamp <= %s" if end is not None else ""
+    cur.execute(f"""
+        SELECT time_stamp, temperature, humidity, soil_moisture
+          FROM rawdata_from_sensors
+         WHERE sensor_id = %s
+           AND time_stamp >= %s
+           {upper_bound}
+      ORDER BY time_stamp
+    """, (sid, start) if end is None else (sid, start, end))
+    rows = cur.fetchall()
+    history = downsample.downsample_history(
+        [r["time_stamp"] for r in rows],
+        {
+            "temperature": [r["temperature"] for r in rows],
+            "humidity": [r["humidity"] for r in rows],
+            # 原始 soil_moisture → 百分比
+            "soil_moisture": [r["soil_moisture"] / 1023 * 100 for r in rows],
+        },
+        points,
+        method
+    )
+    if cacheable:
+        history_cache.put(key, history)
+    return history
+
+@app.route('/', methods=['GET'])
+def dashboard():
+    """前端页面"""
+    return send_from_directory(app.static_folder, "test.html")
+
 @app.route('/sensor-data', methods=['GET'])
 def sensor_data():
     """
-    前端每隔几秒轮询一次，拿到所有传感器的最新值 + 24h 历史 + 告警列表，
+    前端每隔几秒轮询一次，拿到所有传感器的最新值 + 24h 历史 + 未关闭的告警，
     并对 soil_moisture 从原始 ADC 值 (0–1023) 转换为百分比 (0–100)。
+
+    可选参数（传了 points 才启用降采样，否则保持最近 24 条的旧行为）：
+      points : 每个 metric 的目标点数
+      hours  : 历史窗口长度（小时），默认 24
+      end    : 窗口结束时间（ISO 格式），默认该传感器最新一条记录的时间
+      method : lttb（默认）或 minmax
+    降采样后每个 metric 额外返回 <metric>_history_timestamps。
     """
-    conn, cur = get_db_cursor()
+    points = request.args.get("points", type=int)
+    hours = request.args.get("hours", default=24, type=float)
+    method = request.args.get("method", default="lttb")
+    end_arg = request.args.get("end")
+    if method not in downsample.METHODS:
+        return jsonify({"error": f"method 只能是 {', '.join(downsample.METHODS)}"}), 400
+    if points is not None:
+        points = max(2, min(points, config.HISTORY_MAX_POINTS))
+    try:
+        # 带时区的 end 换算成服务器本地的 naive 时间，与库中的时间戳一致
+        end = parse_timestamp(end_arg) if end_arg else None
+    except ValueError:
+        return jsonify({"error": f"无法解析 end: {end_arg}"}), 400
+
+    conn = cur = None
     try:
+        conn, cur = get_db_cursor()
         # 1) 拿到所有 distinct 的 sensor_id
         cur.execute("SELECT DISTINCT sensor_id FROM rawdata_from_sensors;")
         rows = cur.fetchall()
         sensor_ids = [row['sensor_id'] for row in rows]
 
+        # 未关闭的告警走 alerts 表的部分索引，一次查询按 sensor 分组
+        cur.execute("""
+            SELECT sensor_id, level, message, opened_at
+              FROM alerts
+             WHERE closed_at IS NULL
+          ORDER BY opened_at DESC
+        """)
+        open_alerts = {}
+        for row in cur.fetchall():
+            open_alerts.setdefault(row["sensor_id"], []).append({
+                "time": row["opened_at"].isoformat(),
+                "level": row["level"],
+                "message": row["message"]
+            })
+
         result_list = []
         now_utc = datetime.utcnow()
 
@@ -59,49 +196,41 @@ def sensor_data():
             if not latest:
                 continue
 
-            # 3) 查询过去 24h 内最新 24 条记录
-            time_24h_ago = now_utc - timedelta(hours=24)
-            cur.execute("""
-                SELECT temperature, humidity, soil_moisture, time_stamp, is_anomaly
-                  FROM rawdata_from_sensors
-                 WHERE sensor_id = %s
-                   AND time_stamp >= %s
-              ORDER BY time_stamp DESC
-                 LIMIT 24
-            """, (sid, time_24h_ago))
-            last24 = cur.fetchall()
-            # 倒序 → 正序 (从最早到最新)
-            last24.reverse()
-
             temp_hist = []
             hum_hist = []
             soil_hist = []
-            alerts = []
-
-            # 4) 遍历历史记录，推入折线图数组，并收集告警
-            for rec in last24:
-                temp_hist.append(float(rec["temperature"]))
-                hum_hist.append(float(rec["humidity"]))
-
-                # 原始 soil_moisture → 百分比
-                raw_sm = float(rec["soil_moisture"])
-                sm_percent = raw_sm / 1023 * 100
-                soil_hist.append(round(sm_percent, 2))
-
-                if rec["is_anomaly"]:
-                    alerts.append({
-                        "time": rec["time_stamp"].isoformat(),
-                        "level": "warning",
-                        "message": "检测到异常"
-                    })
-
-            # 如果最新那条本身也是告警，要插在最前
-            if latest["is_anomaly"]:
-                alerts.insert(0, {
-                    "time": latest["time_stamp"].isoformat(),
-                    "level": "warning",
-                    "message": "检测到异常"
-                })
+
+            # 3a) 指定了 points：整个窗口降采样
+            #     没有给 end 时窗口以最新一条记录为终点，且不设上限，刚写入的读数不会被截掉
+            if points is not None:
+                window_end = end or latest["time_stamp"]
+                history = downsampled_history(
+                    cur, sid, window_end - timedelta(hours=hours), end, points, method
+                )
+            else:
+                # 3b) 查询过去 24h 内最新 24 条记录
+                time_24h_ago = now_utc - timedelta(hours=24)
+                cur.execute("""
+                    SELECT temperature, humidity, soil_moisture, time_stamp, is_anomaly
+                      FROM rawdata_from_sensors
+                     WHERE sensor_id = %s
+                       AND time_stamp >= %s
+                  ORDER BY time_stamp DESC
+                     LIMIT 24
+                """, (sid, time_24h_ago))
+                last24 = cur.fetchall()
+                # 倒序 → 正序 (从最早到最新)
+                last24.reverse()
+
+                # 4) 遍历历史记录，推入折线图数组
+                for rec in last24:
+                    temp_hist.append(float(rec["temperature"]))
+                    hum_hist.append(float(rec["humidity"]))
+
+                    # 原始 soil_moisture → 百分比
+                    raw_sm = float(rec["soil_moisture"])
+                    sm_percent = raw_sm / 1023 * 100
+                    soil_hist.append(round(sm_percent, 2))
 
             # 5) 处理最新值的转换
             # 最新 soil_moisture 原始读数 → 百分比
@@ -118,37 +247,208 @@ def sensor_data():
                 "humidity": float(latest["humidity"]),
                 "soil_moisture": round(latest_sm_percent, 2),
                 "is_anomaly": bool(latest["is_anomaly"]),
+                # True/False；None 表示未知：listener 还没收到过该传感器的数据，
+                # 或本进程没有运行 listener（serve.py 单独部署 API，见 /readyz 的 listener）
+                "online": liveness.tracker.is_online(sid) if liveness.tracker.active else None,
 
-                # 24h 历史
+                # 24h 历史（降采样时下面会被覆盖）
                 "temperature_history": temp_hist,
                 "humidity_history": hum_hist,
                 "soil_moisture_history": soil_hist,
 
-                # 告警列表
-                "alerts": alerts
+                # 未关闭的告警（由 listen.py 的规则引擎维护）
+                "alerts": open_alerts.get(sid, [])
             }
+            if points is not None:
+                for metric, (timestamps, values) in history.items():
+                    sensor_obj[f"{metric}_history"] = values
+                    sensor_obj[f"{metric}_history_timestamps"] = timestamps
             result_list.append(sensor_obj)
 
-        cur.close()
-        conn.close()
-
         return jsonify(result_list)
 
     except Exception as e:
-        cur.close()
-        conn.close()
         return jsonify({"error": str(e)}), 500
+    finally:
+        if conn is not None:
+            release_db_cursor(conn, cur)
+
+# soil_moisture 在 API 中统一以百分比返回
+METRIC_SCALE = {"soil_moisture": 100 / 1023}
+
+def scale_metric_summary(metric, summary):
+    factor = METRIC_SCALE.get(metric)
+    if factor is None:
+        return summary
+    scale = lambda v: None if v is None else v * factor
+    return dict(
+        summary,
+        mean=scale(summary["mean"]),
+        min=scale(summary["min"]),
+        max=scale(summary["max"]),
+        percentiles={k: scale(v) for k, v in summary["percentiles"].items()}
+    )
+
+def fleet_stats_from_db(cur, minutes, end, sensor_id, percentiles):
+    """
+    内存中没有覆盖该窗口（或按单个传感器查询）时，用一条聚合 SQL 计算。
+    窗口与内存汇总的口径一致：[end - minutes, end)，end 默认为最新一条记录所在分钟的末尾。
+    """
+    fractions = [p / 100 for p in percentiles]
+    metric_columns = ",\n".join(
+        f"AVG({m}) AS {m}_mean, MIN({m}) AS {m}_min, MAX({m}) AS {m}_max, "
+        f"percentile_cont(%(fractions)s::float8[]) WITHIN GROUP (ORDER BY {m}) AS {m}_pct"
+        for m in fleet.METRICS
+    )
+    sensor_filter = "AND sensor_id = %(sensor_id)s" if sensor_id is not None else ""
+    joined_filter = "AND r.sensor_id = %(sensor_id)s" if sensor_id is not None else ""
+    cur.execute(f"""
+        WITH bounds AS (
+            SELECT COALESCE(%(end)s,
+                            (SELECT date_trunc('minute', MAX(time_stamp)) + INTERVAL '1 minute'
+                               FROM rawdata_from_sensors WHERE TRUE {sensor_filter})) AS window_end
+        )
+        SELECT bounds.window_end,
+               COUNT(r.id) AS readings,
+               AVG(CASE WHEN r.is_anomaly THEN 1.0 ELSE 0.0 END) AS anomaly_rate,
+               {metric_columns}
+          FROM bounds
+          LEFT JOIN rawdata_from_sensors r
+            ON r.time_stamp >= bounds.window_end - %(minutes)s * INTERVAL '1 minute'
+           AND r.time_stamp < bounds.window_end
+           {joined_filter}
+      GROUP BY bounds.window_end
+    """, {"end": end, "minutes": minutes, "sensor_id": sensor_id, "fractions": fractions})
+    row = cur.fetchone()
+
+    metrics = {}
+    for m in fleet.METRICS:
+        pct = row[f"{m}_pct"] or [None] * len(percentiles)
+        metrics[m] = {
+            "count": row["readings"],
+            "mean": row[f"{m}_mean"],
+            "min": row[f"{m}_min"],
+            "max": row[f"{m}_max"],
+            "percentiles": {str(p): v for p, v in zip(percentiles, pct)},
+        }
+    return {
+        "end": row["window_end"].isoformat() if row["window_end"] else None,
+        "readings": row["readings"],
+        "anomaly_rate": None if row["anomaly_rate"] is None else float(row["anomaly_rate"]),
+        "metrics": metrics,
+    }
+
+@app.route('/fleet-stats', methods=['GET'])
+def fleet_stats():
+    """
+    全体（或单个传感器/植物）在一个时间窗口内各 metric 的均值/最值/分位数和异常率。
+      minutes     : 窗口长度（分钟），默认 60
+      end         : 窗口结束时间（ISO 格式），不含该时刻；默认为最新数据所在分钟的末尾
+      sensor_id   : 只统计某个传感器，可写 3 或 plant-3
+      percentiles : 逗号分隔的百分位，默认 50,90,99
+    全体统计优先使用 listen.py 在内存中维护的分钟汇总（source=memory），
+    内存没有覆盖整个窗口时退回数据库聚合（source=database）。
+    """
+    minutes = request.args.get("minutes", default=60, type=int)
+    end_arg = request.args.get("end")
+    sensor_arg = request.args.get("sensor_id")
+    try:
+        # 带时区的 end 换算成服务器本地的 naive 时间，与库中和内存中的时间戳一致
+        end = parse_timestamp(end_arg) if end_arg else None
+        sensor_id = int(sensor_arg.replace("plant-", "")) if sensor_arg else None
+        percentiles = [float(p) for p in request.args.get("percentiles", "50,90,99").split(",")]
+    except ValueError as e:
+        return jsonify({"error": f"参数错误: {e}"}), 400
+    if minutes <= 0 or not all(0 <= p <= 100 for p in percentiles):
+        return jsonify({"error": "minutes 必须为正数，percentiles 必须在 0–100 之间"}), 400
+    percentiles = [int(p) if p.is_integer() else p for p in percentiles]
+
+    result = None
+    # 内存汇总按整分钟分桶，只能回答整分钟的 end；其他 end 交给数据库，口径保持一致
+    aligned = end is None or end.timestamp() % fleet.stats.bucket_seconds == 0
+    if sensor_id is None and aligned:
+        covered_from, newest = fleet.stats.coverage()
+        window_end = end or newest
+        if covered_from is not None and window_end - timedelta(minutes=minutes) >= covered_from:
+            result = fleet.stats.summary(minutes, end, percentiles)
+            result["source"] = "memory"
+
+    if result is None:
+        conn = cur = None
+        try:
+            conn, cur = get_db_cursor()
+            result = fleet_stats_from_db(cur, minutes, end, sensor_id, percentiles)
+            result["source"] = "database"
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        finally:
+            if conn is not None:
+                release_db_cursor(conn, cur)
+
+    result["metrics"] = {m: scale_metric_summary(m, v) for m, v in result["metrics"].items()}
+    result["minutes"] = minutes
+    result["sensor_id"] = f"plant-{sensor_id}" if sensor_id is not None else None
+    return jsonify(result)
+
+@app.route('/liveness', methods=['GET'])
+def liveness_status():
+    """
+    传感器在线/离线统计，直接读取 liveness.tracker 的计数，O(1)。
+    ?details=1 时附带离线传感器 ID 列表。
+    在线状态只保存在 listener 所在进程的内存里；本进程没有 listener 时返回 503。
+    """
+    if not liveness.tracker.active:
+        return jsonify({
+            "status": "unavailable",
+            "error": "本进程没有运行 listener，在线状态不可用（请通过 main.py 启动的 API 查询）"
+        }), 503
+    result = liveness.tracker.counts()
+    result["timeout"] = liveness.tracker.timeout
+    if request.args.get("details") in ("1", "true"):
+        result["offline_sensors"] = liveness.tracker.offline_sensors()
+    return jsonify(result)
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """存活检查：进程能响应即返回 200。"""
+    return jsonify(health.status())
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """
+    就绪检查：MQTT 已连接且数据库连接池可用时返回 200，否则 503（包括正在退出时）。
+    本进程没有 listener（serve.py）时，改为实际查询一次数据库，确认 API 依赖的数据库可用；
+    listener 字段表示本进程是否运行 listener，即 /liveness 和 online 是否可用。
+    """
+    result = health.status()
+    result["listener"] = liveness.tracker.active
+    if not liveness.tracker.active:
+        result["components"]["database"] = ping_database()
+        result["ready"] = result["ready"] and result["components"]["database"]
+    return jsonify(result), (200 if result["ready"] else 503)
+
+def ping_database(timeout=1):
+    conn = cur = None
+    try:
+        conn, cur = get_db_cursor(timeout=timeout)
+        cur.execute("SELECT 1")
+        return True
+    except Exception:
+        return False
+    finally:
+        if conn is not None:
+            release_db_cursor(conn, cur)
 
 def main():
     """
     可直接 `python calc.py` 启动，对外暴露 /sensor-data 接口。
-    建议生产环境使用 WSGI 服务器，这里仅用于开发调试。
+    这里是 Flask 自带的开发服务器，仅用于开发调试；生产环境用 `python serve.py`。
     """
     # 如果你仍要 file:// 打开前端页面，请启用以下 CORS：
     # from flask_cors import CORS
     # CORS(app)
 
-    app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
+    app.run(host=config.API_HOST, port=config.API_PORT, debug=False, use_reloader=False)
 
 if __name__ == '__main__':
     main()
@@ -12,6 +12,35 @@ class Config:
     DB_USER = os.getenv("DB_USER", "postgres")
     DB_PASSWORD = os.getenv("DB_PASSWORD", "innovatinsa-piwio-5432")
 
+    # 告警规则文件（JSON），留空则使用 rules.DEFAULT_RULES
+    ALERT_RULES_FILE = os.getenv("ALERT_RULES_FILE", "")
+
+    # 传感器离线判定：超过 LIVENESS_TIMEOUT 秒没有数据即视为离线，检测精度 LIVENESS_RESOLUTION 秒
+    LIVENESS_TIMEOUT = float(os.getenv("LIVENESS_TIMEOUT", "60"))
+    LIVENESS_RESOLUTION = float(os.getenv("LIVENESS_RESOLUTION", "0.1"))
+
+    # 入库去重：内存中记住最近写入的 (sensor_id, timestamp) 个数
+    DEDUP_CAPACITY = int(os.getenv("DEDUP_CAPACITY", "100000"))
+
+    # API 服务配置（serve.py）：worker 进程数默认 2*CPU+1，每个 worker 的线程数与连接池大小一致
+    API_HOST = os.getenv("API_HOST", "0.0.0.0")
+    API_PORT = int(os.getenv("API_PORT", "5000"))
+    API_WORKERS = int(os.getenv("API_WORKERS", str(2 * (os.cpu_count() or 1) + 1)))
+    API_THREADS = int(os.getenv("API_THREADS", "4"))
+    API_DB_POOL_SIZE = int(os.getenv("API_DB_POOL_SIZE", os.getenv("API_THREADS", "4")))
+    # 静态资源缓存时间（秒），默认一年
+    STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", str(365 * 24 * 3600)))
+
+    # 历史曲线降采样：单个 metric 最多返回的点数、每个进程缓存的窗口数，
+    # 以及窗口结束多少秒之后视为不再变化（可以缓存）
+    HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", "2000"))
+    HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", "1024"))
+    HISTORY_IMMUTABLE_AFTER = int(os.getenv("HISTORY_IMMUTABLE_AFTER", "300"))
+
+    # 全体汇总统计：内存中保留多少个分钟桶，分位数草图的相对误差
+    FLEET_STATS_RETENTION = int(os.getenv("FLEET_STATS_RETENTION", "1440"))
+    FLEET_STATS_ALPHA = float(os.getenv("FLEET_STATS_ALPHA", "0.01"))
+
     # 连接字符串
     @property
     def DB_URL(self):
@@ -5,17 +5,31 @@ from psycopg2 import sql
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from config import config
 
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "..", "sql", "migrations")
+
+# pg_advisory_lock 的键：多个实例同时启动时只有一个在执行迁移
+MIGRATION_LOCK_ID = 20250603
+
 
 class DatabaseManager:
     def __init__(self):
         self.conn = None
-        self.initialized = False
+        self.applied_migrations = []
+
+    def close(self):
+        """关闭当前连接（如果有）"""
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+        self.conn = None
 
     def connect(self, url=None):
         """连接到数据库"""
         if url is None:
             url = config.DB_URL
 
+        # 重新连接前先关掉旧连接，避免泄漏
+        self.close()
+
         max_retries = 2
         for i in range(max_retries):
             try:
@@ -75,13 +89,16 @@ class DatabaseManager:
                 self.conn.close()
 
     def execute_sql_file(self, file_path):
-        """执行SQL文件"""
+        """执行SQL文件（复用当前连接，没有连接时才新建）"""
+        cursor = None
         try:
-            self.connect()
+            if self.conn is None or self.conn.closed:
+                if not self.connect():
+                    return False
             cursor = self.conn.cursor()
 
             # 读取SQL文件
-            with open(file_path, 'r') as f:
+            with open(file_path, 'r', encoding='utf-8') as f:
                 sql_commands = f.read()
 
             # 执行SQL命令
@@ -91,41 +108,80 @@ class DatabaseManager:
             return True
         except Exception as e:
             print(f"executing sql file failed: {e}")
+            if self.conn is not None and not self.conn.closed:
+                self.conn.rollback()
             return False
         finally:
             if cursor:
                 cursor.close()
 
-    def check_tables(self):
-        """检查必要的表是否存在"""
-        required_tables = ["rawdata_from_sensors", "plants"]  # 根据你的应用修改
-
+    @staticmethod
+    def list_migrations():
+        """返回 [(version, name, path)]，文件名形如 0002_alerts.sql，按版本号排序"""
+        migrations = []
+        for filename in os.listdir(MIGRATIONS_DIR):
+            if not filename.endswith(".sql"):
+                continue
+            version, _, name = filename[:-4].partition("_")
+            migrations.append((int(version), name, os.path.join(MIGRATIONS_DIR, filename)))
+        return sorted(migrations)
+
+    def migrate(self):
+        """
+        在当前连接上执行尚未应用的迁移，每个迁移一个事务，并记录到 schema_migrations。
+        库已是最新时只需一次查询。返回本次应用的迁移版本列表。
+        """
+        migrations = self.list_migrations()
+        cursor = self.conn.cursor()
         try:
-            self.connect()
-            cursor = self.conn.cursor()
-
-            # 检查表是否存在
-            for table in required_tables:
-                cursor.execute(
-                    "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = %s)",
-                    (table,)
-                )
-                exists = cursor.fetchone()[0]
-                if not exists:
-                    print(f"table not exists: {table}")
-                    return False
-
-            print("all tables exist")
-            return True
-        except Exception as e:
-            print(f"failed to check tables: {e}")
-            return False
+            cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+            if cursor.fetchone()[0]:
+                cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+                if cursor.fetchone()[0] >= migrations[-1][0]:
+                    self.conn.commit()
+                    return []
+
+            cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+            try:
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        name VARCHAR(100) NOT NULL,
+                        applied_at TIMESTAMP NOT NULL DEFAULT now()
+                    )
+                """)
+                cursor.execute("SELECT version FROM schema_migrations")
+                applied = {row[0] for row in cursor.fetchall()}
+                self.conn.commit()
+
+                newly_applied = []
+                for version, name, path in migrations:
+                    if version in applied:
+                        continue
+                    with open(path, 'r', encoding='utf-8') as f:
+                        cursor.execute(f.read())
+                    cursor.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                        (version, name)
+                    )
+                    self.conn.commit()
+                    print(f"migration applied: {version:04d}_{name}")
+                    newly_applied.append(version)
+                return newly_applied
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+                self.conn.commit()
         finally:
-            if cursor:
-                cursor.close()
+            cursor.close()
 
     def initialize_database(self):
-        """初始化数据库"""
+        """
+        初始化数据库：只用一个连接完成检查和迁移，完成后立即释放。
+        （旧库中已经存在的表不受影响，迁移脚本都是 IF NOT EXISTS 的）
+        """
         # 创建数据库
         #if not self.create_database():
             #return False
@@ -134,22 +190,18 @@ class DatabaseManager:
         if not self.connect():
             return False
 
-        # 检查表是否存在
-        if self.check_tables():
-            print("database initialized")
-            return True
-
-        # 执行初始化脚本
-        print("initializing...")
-        schema_path = os.path.join(os.path.dirname(__file__), "..", "sql", "schema.sql")
-        if self.execute_sql_file(schema_path):
-            # 执行初始化数据脚本
-            #init_path = os.path.join(os.path.dirname(__file__), "..", "sql", "init.sql")
-            #self.execute_sql_file(init_path)
-            print("initializing success!")
+        try:
+            self.applied_migrations = self.migrate()
+            if self.applied_migrations:
+                print("initializing success!")
+            else:
+                print("database initialized")
             return True
-
-        return False
+        except Exception as e:
+            print(f"database migration failed: {e}")
+            return False
+        finally:
+            self.close()
 
 
 # 全局数据库管理器实例
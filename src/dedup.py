@@ -0,0 +1,44 @@
+# ==========================================
+# dedup.py — 最近写入键的内存过滤器
+# ==========================================
+"""
+QoS 1 订阅和断线重连都会让 Broker 重发消息。数据库里 (sensor_id, time_stamp)
+有唯一约束，INSERT 带 ON CONFLICT DO NOTHING，重复数据不会落库；
+这里再放一层有界 LRU，把明显的重复在到达 PostgreSQL 之前就丢掉，
+避免重连风暴时的无效写入。
+"""
+import threading
+from collections import OrderedDict
+
+from config import config
+
+
+def reading_key(record):
+    """去重键，与数据库唯一约束 (sensor_id, time_stamp) 对应。"""
+    return (record["sensor_id"], str(record["timestamp"]))
+
+
+class RecentKeyFilter:
+    """容量固定的 LRU 集合，超出容量时淘汰最久未出现的键。"""
+
+    def __init__(self, capacity=None):
+        self.capacity = int(config.DEDUP_CAPACITY if capacity is None else capacity)
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                return True
+            return False
+
+    def add(self, key):
+        with self._lock:
+            self._keys[key] = None
+            self._keys.move_to_end(key)
+            if len(self._keys) > self.capacity:
+                self._keys.popitem(last=False)
@@ -0,0 +1,105 @@
+# ==========================================
+# downsample.py — 折线图历史数据降采样
+# ==========================================
+"""
+把任意长度的时间序列压缩到目标点数，保证前端图表的形状基本不变：
+  - lttb   : Largest-Triangle-Three-Buckets，每个桶保留与相邻桶构成三角形面积最大的点
+  - minmax : 每个桶保留最小值和最大值，适合需要看到尖峰的场景
+两种方法都返回被保留点的下标，时间戳和数值由调用方按下标取出。
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+METHODS = ("lttb", "minmax")
+
+
+def lttb(x, y, n):
+    """返回 LTTB 选中的下标（升序，含首尾两点）。"""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    size = len(x)
+    if n >= size:
+        return np.arange(size)
+    if n < 3:
+        return np.unique(np.linspace(0, size - 1, max(n, 1)).astype(int))
+
+    # 去掉首尾两点后分成 n-2 个桶；n < size 时桶宽 > 1，边界严格递增
+    edges = np.linspace(1, size - 1, n - 1).astype(int)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:size - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:size - 1], edges[:-1]) / counts
+    # 第 i 个桶参照的是下一个桶的均值，最后一个桶参照末尾点
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(n, dtype=int)
+    selected[0] = 0
+    selected[-1] = size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs(
+            (x[a] - next_x[i]) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi]) * (next_y[i] - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax(x, y, n):
+    """每个桶保留最小值和最大值的下标（升序），最多 n 个点。"""
+    y = np.asarray(y, dtype=float)
+    size = len(y)
+    if n >= size:
+        return np.arange(size)
+    buckets = max(n // 2, 1)
+    edges = np.linspace(0, size, buckets + 1).astype(int)
+    bucket_of = np.repeat(np.arange(buckets), np.diff(edges))
+    # 按 (桶, 值) 排序后，每个桶的第一个是最小值，最后一个是最大值
+    order = np.lexsort((y, bucket_of))
+    picked = np.concatenate([order[edges[:-1]], order[edges[1:] - 1]])
+    return np.unique(picked)
+
+
+def downsample_history(times, series, points, method="lttb"):
+    """
+    times 为 datetime 列表，series 为 {metric: 数值列表}。
+    每个 metric 单独降采样，返回 {metric: (时间戳 ISO 列表, 数值列表)}。
+    """
+    pick = lttb if method == "lttb" else minmax
+    x = np.array([t.timestamp() for t in times], dtype=float)
+    result = {}
+    for metric, values in series.items():
+        y = np.asarray(values, dtype=float)
+        idx = pick(x, y, points)
+        result[metric] = (
+            [times[i].isoformat() for i in idx],
+            [round(float(v), 2) for v in y[idx]],
+        )
+    return result
+
+
+class HistoryCache:
+    """进程内的 LRU 缓存，只用于已经结束、不会再变化的时间窗口。"""
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self.capacity:
+                self._items.popitem(last=False)
@@ -0,0 +1,232 @@
+# ==========================================
+# fleet.py — 全体传感器的汇总统计
+# ==========================================
+"""
+listen.on_message 每写入一批数据就调用 stats.add_batch(records)：整批数据用 NumPy
+一次性算出 count/sum/min/max，并把数值并入 DDSketch 分位数草图，按分钟归入滚动桶。
+
+查询时只合并窗口内的分钟桶（最多 FLEET_STATS_RETENTION 个），
+耗时与读数总量无关。DDSketch 保证分位数的相对误差不超过 alpha。
+"""
+import math
+import threading
+from datetime import timedelta
+
+import numpy as np
+
+from config import config
+from rules import parse_timestamp
+
+METRICS = ("temperature", "humidity", "soil_moisture")
+
+
+class DDSketch:
+    """
+    相对误差为 alpha 的分位数草图：数值按 gamma = (1+alpha)/(1-alpha) 的对数划分桶，
+    正数、负数分开存储，0 单独计数。两个草图可以直接合并。
+    """
+
+    def __init__(self, alpha=0.01):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+
+    def _add_store(self, store, magnitudes):
+        indexes = np.ceil(np.log(magnitudes) / self._log_gamma).astype(int)
+        for index, n in zip(*np.unique(indexes, return_counts=True)):
+            store[int(index)] = store.get(int(index), 0) + int(n)
+
+    def add(self, values):
+        """批量加入一组数值（NumPy 数组）"""
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+        positive = values[values > 0]
+        negative = values[values < 0]
+        if positive.size:
+            self._add_store(self.positive, positive)
+        if negative.size:
+            self._add_store(self.negative, -negative)
+        self.zeros += int(values.size - positive.size - negative.size)
+        self.count += int(values.size)
+
+    def merge(self, other):
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, n in other_store.items():
+                store[index] = store.get(index, 0) + n
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def _value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        # 从最小的值开始：负数按绝对值从大到小，再是 0，再是正数从小到大
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._value(index)
+        return self._value(max(self.positive))
+
+
+class MetricRollup:
+    """单个 metric 在一个时间桶内的 count/sum/min/max + 分位数草图"""
+
+    def __init__(self, alpha):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.sketch = DDSketch(alpha)
+
+    def add(self, values):
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+        self.count += int(values.size)
+        self.total += float(values.sum())
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+        self.sketch.add(values)
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self.sketch.merge(other.sketch)
+
+    def summary(self, percentiles):
+        if self.count == 0:
+            return {"count": 0, "mean": None, "min": None, "max": None,
+                    "percentiles": {str(p): None for p in percentiles}}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "min": self.minimum,
+            "max": self.maximum,
+            # 草图的估计值限制在真实的 [min, max] 内
+            "percentiles": {
+                str(p): min(max(self.sketch.quantile(p / 100), self.minimum), self.maximum)
+                for p in percentiles
+            },
+        }
+
+
+class Bucket:
+    def __init__(self, alpha):
+        self.readings = 0
+        self.anomalies = 0
+        self.metrics = {m: MetricRollup(alpha) for m in METRICS}
+
+
+class FleetStats:
+    """按分钟滚动的全体汇总；只保留最近 retention 个桶"""
+
+    def __init__(self, bucket_seconds=60, retention=None, alpha=None):
+        self.bucket_seconds = bucket_seconds
+        self.retention = int(config.FLEET_STATS_RETENTION if retention is None else retention)
+        self.alpha = float(config.FLEET_STATS_ALPHA if alpha is None else alpha)
+        self._buckets = {}   # 桶起始时间 -> Bucket
+        self._newest = None
+        # 实时数据完整覆盖的起点：第一批实时数据所在的桶可能只收到了一部分读数，
+        # 从这些桶的末尾开始才是完整的；更早的迟到读数不改变这个起点
+        self._live_since = None
+        self._lock = threading.Lock()
+
+    def _bucket_start(self, when):
+        epoch = when.timestamp()
+        return when - timedelta(seconds=epoch % self.bucket_seconds)
+
+    def add_batch(self, records):
+        """一批读数按所属分钟分组，每组一次向量化更新"""
+        groups = {}
+        for rec in records:
+            try:
+                start = self._bucket_start(parse_timestamp(rec["timestamp"]))
+            except ValueError:
+                continue
+            groups.setdefault(start, []).append(rec)
+        if not groups:
+            return
+
+        with self._lock:
+            if self._live_since is None:
+                self._live_since = max(groups) + timedelta(seconds=self.bucket_seconds)
+            for start, recs in groups.items():
+                bucket = self._buckets.get(start)
+                if bucket is None:
+                    if self._newest is not None and \
+                            start <= self._newest - timedelta(seconds=self.bucket_seconds * self.retention):
+                        continue   # 已经滚出保留期的旧数据
+                    bucket = self._buckets[start] = Bucket(self.alpha)
+                bucket.readings += len(recs)
+                bucket.anomalies += sum(1 for r in recs if r.get("is_anomaly"))
+                for metric in METRICS:
+                    values = np.array(
+                        [r.get(metric) for r in recs], dtype=float
+                    )  # None → nan
+                    bucket.metrics[metric].add(values)
+                if self._newest is None or start > self._newest:
+                    self._newest = start
+            self._evict()
+
+    def _evict(self):
+        horizon = self._newest - timedelta(seconds=self.bucket_seconds * self.retention)
+        for start in [s for s in self._buckets if s <= horizon]:
+            del self._buckets[start]
+
+    def coverage(self):
+        """
+        内存汇总完整覆盖的时间范围 [start, end)：窗口起点不早于 start 时才能用内存回答。
+        start 取实时数据覆盖的起点与保留期下限中较晚的一个。
+        """
+        with self._lock:
+            if self._newest is None:
+                return None, None
+            bucket = timedelta(seconds=self.bucket_seconds)
+            retained = self._newest - bucket * (self.retention - 1)
+            return max(self._live_since, retained), self._newest + bucket
+
+    def summary(self, minutes, end=None, percentiles=(50, 90, 99)):
+        """
+        合并 [end - minutes, end) 内的分钟桶；end 默认为最新数据所在桶的末尾。
+        """
+        with self._lock:
+            if end is None:
+                end = (self._newest + timedelta(seconds=self.bucket_seconds)) if self._newest else None
+            merged = Bucket(self.alpha)
+            if end is not None:
+                start = end - timedelta(minutes=minutes)
+                for bucket_start, bucket in self._buckets.items():
+                    if start <= bucket_start < end:
+                        merged.readings += bucket.readings
+                        merged.anomalies += bucket.anomalies
+                        for metric in METRICS:
+                            merged.metrics[metric].merge(bucket.metrics[metric])
+
+        return {
+            "end": end.isoformat() if end else None,
+            "readings": merged.readings,
+            "anomaly_rate": merged.anomalies / merged.readings if merged.readings else None,
+            "metrics": {m: merged.metrics[m].summary(percentiles) for m in METRICS},
+        }
+
+
+# 全局实例：listen.py 写入，calc.py 读取（需在同一进程内，即经由 main.py 启动）
+stats = FleetStats()
@@ -0,0 +1,62 @@
+# ==========================================
+# health.py — 进程就绪/存活状态
+# ==========================================
+"""
+各组件（数据库迁移、MQTT 连接、数据库连接池……）在状态变化时调用 set_ready()，
+calc.py 的 /readyz、/healthz 只读取这里的状态，不依赖 listen.py 本身。
+
+启动耗时也记录在这里：record_timing() 记录各阶段耗时，
+所有组件第一次全部就绪时记下 startup_seconds（从本模块被导入算起）。
+"""
+import logging
+import threading
+import time
+
+_lock = threading.Lock()
+_components = {}
+_timings = {}
+_started_at = time.monotonic()
+_ready_at = None
+_shutting_down = False
+
+
+def _all_ready():
+    return not _shutting_down and bool(_components) and all(_components.values())
+
+
+def set_ready(name, ready):
+    global _ready_at
+    with _lock:
+        _components[name] = bool(ready)
+        if _ready_at is None and _all_ready():
+            _ready_at = time.monotonic()
+            logging.info(f"🚀 启动完成，用时 {_ready_at - _started_at:.3f}s")
+
+
+def record_timing(name, seconds):
+    with _lock:
+        _timings[name] = round(seconds, 3)
+
+
+def mark_shutting_down():
+    """开始优雅退出后，就绪检查立即失败，负载均衡不再分配流量。"""
+    global _shutting_down
+    with _lock:
+        _shutting_down = True
+
+
+def is_ready():
+    with _lock:
+        return _all_ready()
+
+
+def status():
+    with _lock:
+        return {
+            "ready": _all_ready(),
+            "shutting_down": _shutting_down,
+            "components": dict(_components),
+            "uptime": round(time.monotonic() - _started_at, 3),
+            "startup_seconds": None if _ready_at is None else round(_ready_at - _started_at, 3),
+            "timings": dict(_timings),
+        }
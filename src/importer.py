@@ -0,0 +1,345 @@
+# ==========================================
+# importer.py — 历史数据批量导入 / 回放
+# ==========================================
+"""
+两个子命令：
+
+  python importer.py load   ../sample_data/sample_data.json [--workers 4 --chunk-size 50000]
+  python importer.py replay ../sample_data/sample_data.json --speed 10 [--shift-to-now]
+
+load   : 流式读取 JSON 数组 / NDJSON / CSV（可为 .gz），按块 COPY 进临时表，
+         再以 ON CONFLICT (sensor_id, time_stamp) DO NOTHING 并入 rawdata_from_sensors，
+         多个块由多个连接并行写入。内存中最多只有 workers*2 个块。
+replay : 按原始时间间隔（除以 speed）把同一时刻的读数打包成 JSON 数组发布到 MQTT，
+         格式与 control.py 相同，listen.py 会像处理实时数据一样处理它们。
+
+导入的数据直接写库，不经过 listen.py，因此不会触发告警规则，也不计入内存中的统计。
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+import psycopg2
+
+from config import config
+from rules import normalize_reading, parse_timestamp
+
+COLUMNS = ("sensor_id", "time_stamp", "temperature", "humidity", "soil_moisture", "is_anomaly")
+
+
+# -------------------------------------------------
+# 1. 流式读取：每次只在内存中保留一条记录
+# -------------------------------------------------
+def open_text(path):
+    # utf-8-sig 去掉 Excel 等工具导出时加的 BOM，否则 CSV 的第一个列名会变成 "\ufeffsensor_id"
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8-sig", newline="")
+    return open(path, "r", encoding="utf-8-sig", newline="")
+
+
+def iter_json_array(f, chunk_size=1 << 16, max_buffer=64 << 20):
+    """
+    增量解析顶层 JSON 数组，逐个产出数组元素。
+    单个元素超过 max_buffer 个字符仍无法解析时报错（通常是文件格式错误），避免无限读入内存。
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    started = False
+    eof = False
+    while True:
+        # 跳过空白、开头的 '[' 和元素之间的 ','
+        while pos < len(buf) and (buf[pos].isspace() or buf[pos] == "," or (buf[pos] == "[" and not started)):
+            if buf[pos] == "[":
+                started = True
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        if pos < len(buf):
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+                # 数字等标量可能正好被截断在块边界上（"12|3"、"-6.5|e-3"），
+                # 后面紧跟空白、',' 或 ']' 时才算完整
+                if eof or (end < len(buf) and (buf[end].isspace() or buf[end] in ",]")):
+                    yield item
+                    pos = end
+                    continue
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+        if eof:
+            return
+        if len(buf) - pos > max_buffer:
+            raise ValueError(f"JSON 元素超过 {max_buffer} 个字符仍无法解析，文件格式可能有误")
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
+def iter_records(path):
+    """
+    根据扩展名选择解析方式，统一产出 dict：
+      .csv            : 表头为字段名（timestamp 或 time_stamp 均可）
+      .ndjson / .jsonl: 每行一个对象，或每行一个数组（例如按批归档的 MQTT 消息）
+      其他            : 顶层为数组的 JSON 文件，元素可以是对象或对象数组
+    """
+    name = path[:-3] if path.endswith(".gz") else path
+    with open_text(path) as f:
+        if name.endswith(".csv"):
+            yield from csv.DictReader(f)
+            return
+        if name.endswith((".ndjson", ".jsonl")):
+            items = (json.loads(line) for line in f if line.strip())
+        else:
+            items = iter_json_array(f)
+        for item in items:
+            if isinstance(item, list):
+                yield from item
+            else:
+                yield item
+
+
+def normalize(rec):
+    """
+    转换成数据库的一行；校验规则与 listen.py 的实时写入相同（rules.normalize_reading），
+    缺字段、无法转换或数值不是有限数时返回 None。
+    """
+    reading = normalize_reading(rec)
+    if reading is None:
+        return None
+    return (
+        reading["sensor_id"],
+        # 统一格式化为 ISO 时间戳：原始字符串可能含逗号（如小数秒写成 ",5"），会破坏 CSV
+        reading["timestamp"].isoformat(),
+        reading["temperature"],
+        reading["humidity"],
+        reading["soil_moisture"],
+        reading["is_anomaly"],
+    )
+
+
+# -------------------------------------------------
+# 2. load：COPY 到临时表，再去重并入主表
+# -------------------------------------------------
+MERGE_SQL = f"""
+    INSERT INTO rawdata_from_sensors ({", ".join(COLUMNS)})
+    SELECT DISTINCT ON (sensor_id, time_stamp) {", ".join(COLUMNS)}
+      FROM import_staging
+    ON CONFLICT (sensor_id, time_stamp) DO NOTHING
+"""
+
+
+def connect():
+    return psycopg2.connect(
+        host     = config.DB_HOST,
+        port     = config.DB_PORT,
+        dbname   = config.DB_NAME,
+        user     = config.DB_USER,
+        password = config.DB_PASSWORD
+    )
+
+
+STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS import_staging (
+        sensor_id INTEGER,
+        time_stamp TIMESTAMP,
+        temperature FLOAT,
+        humidity FLOAT,
+        soil_moisture FLOAT,
+        is_anomaly BOOLEAN
+    ) ON COMMIT DELETE ROWS
+"""
+
+
+def copy_chunk(conn, rows):
+    """在给定连接上写入一个块，返回实际插入的行数。"""
+    # 各列都是数字、布尔或 datetime.isoformat() 生成的时间戳，不需要 CSV 转义，直接格式化更快
+    buf = io.StringIO("".join("%d,%s,%r,%r,%r,%s\n" % row for row in rows))
+    try:
+        with conn.cursor() as cur:
+            cur.execute(STAGING_SQL)
+            cur.copy_expert(
+                f"COPY import_staging ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buf
+            )
+            cur.execute(MERGE_SQL)
+            inserted = cur.rowcount
+        conn.commit()
+        return inserted
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def load(path, workers, chunk_size):
+    import database
+    if not database.db_manager.initialize_database():
+        print("❌ 数据库初始化失败")
+        return 1
+
+    started = time.perf_counter()
+    local = threading.local()
+    connections = []
+    # 同时在途的块最多 workers*2 个，读文件的速度被写库的速度限制住，内存恒定
+    in_flight = threading.BoundedSemaphore(workers * 2)
+    totals = {"read": 0, "skipped": 0, "inserted": 0}
+    lock = threading.Lock()
+
+    def work(rows):
+        try:
+            if getattr(local, "conn", None) is None:
+                local.conn = connect()
+                with lock:
+                    connections.append(local.conn)
+            inserted = copy_chunk(local.conn, rows)
+            with lock:
+                totals["inserted"] += inserted
+        finally:
+            in_flight.release()
+
+    pending = set()
+
+    def check(done):
+        # 块一完成就检查结果：有块失败时立即抛出，不再继续读文件和提交新块
+        for future in done:
+            pending.discard(future)
+            future.result()
+
+    def submit(rows):
+        in_flight.acquire()
+        pending.add(pool.submit(work, rows))
+        check([f for f in pending if f.done()])
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        chunk = []
+        for rec in iter_records(path):
+            totals["read"] += 1
+            row = normalize(rec)
+            if row is None:
+                totals["skipped"] += 1
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                submit(chunk)
+                chunk = []
+        if chunk:
+            submit(chunk)
+        while pending:
+            check(wait(pending, return_when=FIRST_COMPLETED).done)
+    except Exception as e:
+        # 已提交成功的块不会回滚；修正后重新导入即可，重复的行由唯一约束跳过
+        print(f"❌ 导入失败：{e}（已写入 {totals['inserted']} 条）")
+        return 1
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        for conn in connections:
+            conn.close()
+
+    elapsed = time.perf_counter() - started
+    valid = totals["read"] - totals["skipped"]
+    print(f"✅ 导入完成：读取 {totals['read']} 条，无效 {totals['skipped']} 条，"
+          f"新增 {totals['inserted']} 条，重复 {valid - totals['inserted']} 条，"
+          f"用时 {elapsed:.2f}s（{valid / elapsed if elapsed else 0:.0f} 条/秒）")
+    return 0
+
+
+# -------------------------------------------------
+# 3. replay：按 N 倍速重新发布到 MQTT
+# -------------------------------------------------
+def iter_batches(path):
+    """连续的、时间戳相同的记录合成一批（与 control.py 每次发布一批相同）。"""
+    batch = []
+    current = None
+    for rec in iter_records(path):
+        row = normalize(rec)
+        if row is None:
+            continue
+        when = parse_timestamp(row[1])
+        if current is not None and when != current:
+            yield current, batch
+            batch = []
+        current = when
+        batch.append(row)
+    if batch:
+        yield current, batch
+
+
+def replay(path, speed, shift_to_now, broker, port, topic):
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
+    client.connect(broker, port)
+    client.loop_start()
+    print(f"[Info] 回放 {path} → {broker}:{port} '{topic}'，速度 {speed}×")
+
+    offset = None
+    previous = None
+    published = 0
+    try:
+        for when, batch in iter_batches(path):
+            if previous is not None and speed > 0:
+                time.sleep(max((when - previous).total_seconds(), 0) / speed)
+            previous = when
+            if shift_to_now and offset is None:
+                offset = datetime.now().replace(microsecond=0) - when
+            stamp = (when + offset) if offset is not None else when
+            payload = [
+                {
+                    "sensor_id": row[0],
+                    "timestamp": stamp.isoformat(),
+                    "temperature": row[2],
+                    "humidity": row[3],
+                    "soil_moisture": row[4],
+                    "is_anomaly": row[5],
+                }
+                for row in batch
+            ]
+            client.publish(topic, json.dumps(payload, ensure_ascii=False), qos=1).wait_for_publish()
+            published += len(payload)
+    except KeyboardInterrupt:
+        print("\n[Info] 收到 Ctrl+C，停止回放。")
+    finally:
+        client.loop_stop()
+        client.disconnect()
+    print(f"[Info] 共发布 {published} 条")
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="历史数据批量导入 / MQTT 回放工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_load = sub.add_parser("load", help="批量导入到数据库（按 sensor_id + 时间戳去重）")
+    p_load.add_argument("path", help="JSON / NDJSON / CSV 文件，可为 .gz")
+    p_load.add_argument("--workers", "-w", type=int, default=4, help="并行写入的连接数（默认 4）")
+    p_load.add_argument("--chunk-size", "-c", type=int, default=50000, help="每个 COPY 块的行数（默认 50000）")
+
+    p_replay = sub.add_parser("replay", help="按原始节奏（可加速）重新发布到 MQTT")
+    p_replay.add_argument("path", help="JSON / NDJSON / CSV 文件，可为 .gz")
+    p_replay.add_argument("--speed", "-s", type=float, default=1.0, help="回放倍速，0 表示不等待（默认 1）")
+    p_replay.add_argument("--shift-to-now", action="store_true",
+                          help="把时间戳整体平移到当前时间，避免被当作重复数据丢弃")
+    p_replay.add_argument("--broker", "-b", default=os.getenv("MQTT_BROKER", "test.mosquitto.org"))
+    p_replay.add_argument("--port", "-p", type=int, default=int(os.getenv("MQTT_PORT", 1883)))
+    p_replay.add_argument("--topic", "-t", default=os.getenv("MQTT_REPLAY_TOPIC", "greenhouse/sensors"))
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "load":
+        return load(args.path, args.workers, args.chunk_size)
+    return replay(args.path, args.speed, args.shift_to_now, args.broker, args.port, args.topic)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
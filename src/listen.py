@@ -3,13 +3,22 @@
 # ==========================================
 import os
 import json
-import time
+import random
+import signal
 import logging
+import threading
 from dotenv import load_dotenv
 
 import paho.mqtt.client as mqtt
 import psycopg2
 from psycopg2 import pool
+from psycopg2.extras import execute_values
+
+import dedup
+import fleet
+import health
+import liveness
+from rules import RuleEngine, normalize_reading
 
 # -------------------------------------------------
 # 1. 从环境变量中读取 DB/MQTT 配置
@@ -21,6 +30,10 @@ MQTT_PORT   = int(os.getenv("MQTT_PORT", 1883))
 TOPIC       = os.getenv("MQTT_TOPIC", "greenhouse/#")
 CLIENT_ID   = os.getenv("MQTT_CLIENT_ID", "mqtt-listener")
 
+# 断线重连退避（秒）：由 paho 网络线程自己重连并逐次翻倍；起始延迟在启动和每次连接成功后重新抖动
+RECONNECT_MIN_DELAY = float(os.getenv("MQTT_RECONNECT_MIN_DELAY", 1))
+RECONNECT_MAX_DELAY = float(os.getenv("MQTT_RECONNECT_MAX_DELAY", 60))
+
 DB_HOST     = os.getenv("DB_HOST", "innovatinsa.piwio.fr")
 DB_PORT     = int(os.getenv("DB_PORT", 5432))
 DB_NAME     = os.getenv("DB_NAME", "group02")
@@ -40,6 +53,16 @@ logging.basicConfig(
 #    （避免频繁 open/close）
 # -------------------------------------------------
 db_pool = None
+# 告警规则在启动时编译一次，之后每批数据增量求值
+rule_engine = RuleEngine()
+# 最近成功写入的 (sensor_id, timestamp)，用于在到达数据库之前丢弃重发的消息
+recent_keys = dedup.RecentKeyFilter()
+# evaluate()（paho 线程）和 tick()（定时线程）产生的告警变化必须按产生的顺序写库，
+# 否则同一告警的 open/close 可能以相反顺序提交，留下永远不关闭的告警行
+alert_lock = threading.Lock()
+# 告警写库失败后，规则引擎的 _open 与 alerts 表不再一致；置位后在下一批数据到达时以表为准重新加载
+alerts_out_of_sync = False
+
 def init_db_pool():
     global db_pool
     if db_pool is None:
@@ -54,16 +77,30 @@ def init_db_pool():
                 password = DB_PASSWORD
             )
             logging.info("✅ 数据库连接池已初始化")
+            health.set_ready("database", True)
+            rule_engine.restore(load_open_alerts())
         except Exception as e:
             logging.error(f"数据库连接池初始化失败: {e}")
             raise
 
 # -------------------------------------------------
-# 4. 插入一条传感器数据到 rawdata_from_sensors 表
+# 4. 写入数据库：
+#    - save_batch_to_db: 一批传感器数据一次性插入 rawdata_from_sensors
+#    - save_alert_transitions: 把规则引擎产生的告警状态变化写入 alerts
 # -------------------------------------------------
-def save_to_db(sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly):
+INSERT_READINGS_SQL = """
+    INSERT INTO rawdata_from_sensors
+    (sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly)
+    VALUES %s
+    ON CONFLICT (sensor_id, time_stamp) DO NOTHING
+    RETURNING sensor_id, time_stamp
+"""
+
+def save_batch_to_db(records):
     """
-    用连接池取一个连接，插入一条记录。
+    用连接池取一个连接，用 execute_values 一次插入整批记录。
+    (sensor_id, time_stamp) 已存在的记录由唯一约束跳过，重复写入是幂等的。
+    返回实际插入的记录（由 RETURNING 得到），失败时返回 None。
     遇到任何错误先 rollback，再把连接还回去。
     """
     conn = None
@@ -71,24 +108,65 @@ def save_to_db(sensor_id, time_stamp, temperature, humidity, soil_moisture, is_a
     try:
         conn = db_pool.getconn()
         cursor = conn.cursor()
-        sql = """
-            INSERT INTO rawdata_from_sensors
-            (sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """
-        # 如果 time_stamp 是字符串，确保数据库列可接受 ISO 格式，或自行先 parse
-        cursor.execute(sql, (sensor_id, time_stamp,
-                             temperature, humidity, soil_moisture, is_anomaly))
-        new_id = cursor.fetchone()[0]
+        # records 已经过 normalize_reading，字段齐全且类型正确
+        rows = [
+            (r["sensor_id"], r["timestamp"], r["temperature"], r["humidity"],
+             r["soil_moisture"], r["is_anomaly"])
+            for r in records
+        ]
+        # page_size 设为整批，保证只发一条语句；RETURNING 只返回真正插入的行
+        returned = execute_values(
+            cursor, INSERT_READINGS_SQL, rows, page_size=max(len(rows), 1), fetch=True
+        )
         conn.commit()
-        logging.info(f"插入成功，ID={new_id}, sensor_id={sensor_id}")
+        inserted_keys = {(sensor_id, time_stamp) for sensor_id, time_stamp in returned}
+        inserted = [r for r in records if (r["sensor_id"], r["timestamp"]) in inserted_keys]
+        logging.info(f"插入成功，共 {len(inserted)} 条，跳过重复 {len(rows) - len(inserted)} 条")
+        return inserted
     except psycopg2.Error as e:
         logging.error(f"PostgreSQL 插入失败: {e}")
         if conn:
             conn.rollback()
     except Exception as e:
-        logging.error(f"save_to_db 出现异常: {e}")
+        logging.error(f"save_batch_to_db 出现异常: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            db_pool.putconn(conn)
+    return None
+
+def save_alert_transitions(transitions):
+    """
+    open → 新增一行告警；close → 给该 (rule, sensor) 未关闭的告警填上 closed_at。
+    全部写入成功（或没有需要写的）返回 True，失败返回 False。
+    """
+    if not transitions:
+        return True
+    conn = None
+    cursor = None
+    try:
+        conn = db_pool.getconn()
+        cursor = conn.cursor()
+        for t in transitions:
+            if t.action == "open":
+                cursor.execute("""
+                    INSERT INTO alerts (rule_name, sensor_id, level, message, value, opened_at)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """, (t.rule_name, t.sensor_id, t.level, t.message,
+                      None if t.value is None else float(t.value), t.time))
+            else:
+                cursor.execute("""
+                    UPDATE alerts SET closed_at = %s
+                     WHERE rule_name = %s AND sensor_id = %s AND closed_at IS NULL
+                """, (t.time, t.rule_name, t.sensor_id))
+        conn.commit()
+        logging.info(f"🔔 告警状态变化 {len(transitions)} 条")
+        return True
+    except psycopg2.Error as e:
+        logging.error(f"PostgreSQL 写入告警失败: {e}")
         if conn:
             conn.rollback()
     finally:
@@ -96,12 +174,47 @@ def save_to_db(sensor_id, time_stamp, temperature, humidity, soil_moisture, is_a
             cursor.close()
         if conn:
             db_pool.putconn(conn)
+    return False
+
+def resync_alerts():
+    """以 alerts 表为准重新加载未关闭的告警；数据库仍不可用时保持置位，下次再试。"""
+    global alerts_out_of_sync
+    try:
+        rule_engine.restore(load_open_alerts())
+        alerts_out_of_sync = False
+        logging.info("🔄 已按 alerts 表重新同步告警状态")
+    except psycopg2.Error as e:
+        logging.error(f"❌ 重新同步告警状态失败: {e}")
+
+def apply_rules(evaluate, resync=True):
+    """
+    在 alert_lock 内求值并写库，保证告警状态变化与规则引擎的内部状态顺序一致。
+    写库失败时规则引擎已经更新了状态：置位 alerts_out_of_sync，下次 resync=True 的调用
+    （即下一批数据）先从 alerts 表恢复，丢失的 open 会被重新触发，丢失的 close 会被重新关闭。
+    定时线程传 resync=False，避免数据库不可用时每个 tick 都去重试。
+    """
+    global alerts_out_of_sync
+    with alert_lock:
+        if alerts_out_of_sync and resync:
+            resync_alerts()
+        if not save_alert_transitions(evaluate()):
+            alerts_out_of_sync = True
+
+def load_open_alerts():
+    """读取 alerts 表中未关闭的告警，用于重启后恢复规则引擎状态。"""
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT rule_name, sensor_id FROM alerts WHERE closed_at IS NULL")
+            return cursor.fetchall()
+    finally:
+        db_pool.putconn(conn)
 
 # -------------------------------------------------
 # 5. MQTT 回调：
 #    - on_connect: 连接成功后订阅
 #    - on_message: 收到消息并保存到 DB
-#    - on_disconnect: 尝试重连
+#    - on_disconnect: 记录断开，重连交给 paho 的网络线程
 # -------------------------------------------------
 def on_connect(client, userdata, flags, reason_code, properties=None):
     """
@@ -111,6 +224,9 @@ def on_connect(client, userdata, flags, reason_code, properties=None):
     if reason_code == 0:
         logging.info("✅ 连接到 MQTT Broker 成功")
         client.subscribe(TOPIC, qos=1)
+        health.set_ready("mqtt", True)
+        # 连接成功后 paho 会把退避重置为 min_delay；这里换一个新的随机起点供下一次断线使用
+        jittered_reconnect_delay(client)
     else:
         logging.error(f"❌ 连接失败，返回码: {reason_code}")
 
@@ -129,41 +245,126 @@ def on_message(client, userdata, msg):
         logging.error(f"❌ 无法解码消息: {e}")
         return
 
-    # 解析必需字段
-    sensor_id    = payload.get("sensor_id")
-    time_stamp   = payload.get("timestamp")
-    temperature  = payload.get("temperature")
-    humidity     = payload.get("humidity")
-    soil_moisture= payload.get("soil_moisture")
-    is_anomaly   = payload.get("is_anomaly", False)
-
-    # 校验字段完整性（简单示例，可根据需求再加强）
-    if sensor_id is None or time_stamp is None:
-        logging.error(f"❌ 必需字段缺失: {payload}")
+    # control.py 一次发布一个 JSON 数组，单个传感器也可以只发一个对象
+    records = payload if isinstance(payload, list) else [payload]
+
+    # 校验并规范化每条读数；不合格的只丢弃这一条，不影响同一批的其他读数
+    valid = []
+    for rec in records:
+        reading = normalize_reading(rec)
+        if reading is None:
+            logging.error(f"❌ 字段缺失或格式错误，已丢弃: {rec}")
+            continue
+        valid.append(reading)
+
+    # 丢弃最近已写入过的重复消息（包括同一批内部的重复）
+    fresh = []
+    batch_keys = set()
+    for rec in valid:
+        key = dedup.reading_key(rec)
+        if key in recent_keys or key in batch_keys:
+            continue
+        batch_keys.add(key)
+        fresh.append(rec)
+    if len(fresh) < len(valid):
+        logging.info(f"♻️ 丢弃重复消息 {len(valid) - len(fresh)} 条")
+    valid = fresh
+    if not valid:
         return
 
-    save_to_db(sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly)
+    # 在线状态在写库之前更新：数据库故障期间仍在上报的传感器不应被判为离线
+    # 只更新时间戳，O(1)；离线的传感器再次上报时产生 recovered 事件
+    try:
+        for rec in valid:
+            log_liveness_event(liveness.tracker.seen(rec["sensor_id"]))
+    except Exception as e:
+        logging.error(f"❌ 更新在线状态失败: {e}")
+
+    inserted = save_batch_to_db(valid)
+    if inserted is None:
+        return
+    # 数据库里已有的记录同样算作“已写入”，之后的重发在这里就被丢弃
+    for key in batch_keys:
+        recent_keys.add(key)
 
-def on_disconnect(client, userdata, reason_code, properties=None):
+    # 写库之后的处理出错只记录日志：异常一旦抛出 on_message，paho 的网络线程就会退出
+    try:
+        # 统计和规则只处理真正新增的行，重复数据不会被计两次
+        if inserted:
+            fleet.stats.add_batch(inserted)
+        apply_rules(lambda: rule_engine.evaluate(inserted))
+    except Exception as e:
+        logging.error(f"❌ 写库后的处理失败: {e}")
+
+def jittered_reconnect_delay(client):
+    """
+    起始延迟在 [min, 2*min) 内随机，之后由 paho 逐次翻倍直到 max。
+    多个 listener 同时断线时不会在同一时刻一起冲向 Broker 和数据库。
+    reconnect_delay_set 会清空 paho 当前的退避，所以只在启动时和连接成功后调用。
     """
-    同样做成兼容 Paho v1.5/v1.6+ 的形式。
-    如果断开连接，就尝试不断重连。
+    client.reconnect_delay_set(
+        min_delay=RECONNECT_MIN_DELAY * (1 + random.random()),
+        max_delay=RECONNECT_MAX_DELAY
+    )
+
+def on_disconnect(client, userdata, flags, reason_code, properties=None):
     """
-    logging.warning(f"⚠️ 连接断开！ code={reason_code}，开始尝试重连...")
-    delay = 1
-    while True:
+    Paho v2 回调签名 (client, userdata, disconnect_flags, reason_code, properties)。
+    这里不能阻塞：loop_start() 的网络线程会按 reconnect_delay_set 的退避自动重连。
+    """
+    health.set_ready("mqtt", False)
+    if stop_event.is_set():
+        logging.info("🔌 已断开 MQTT 连接")
+        return
+    logging.warning(f"⚠️ 连接断开！ code={reason_code}，等待自动重连...")
+
+def log_liveness_event(event):
+    if event is None:
+        return
+    if event.kind == "offline":
+        logging.warning(f"📴 传感器离线: sensor_id={event.sensor_id}")
+    else:
+        logging.info(f"📶 传感器恢复: sensor_id={event.sensor_id}")
+
+def tick_loop(interval=None):
+    """
+    定时推进：
+      - 在线检测时间轮，精度为 LIVENESS_RESOLUTION 秒
+      - 规则引擎中到期的 missing 规则
+    """
+    interval = interval or liveness.tracker.resolution
+    while not stop_event.wait(interval):
         try:
-            client.reconnect()
-            logging.info("✅ 重连成功")
-            return
+            for event in liveness.tracker.advance():
+                log_liveness_event(event)
+            apply_rules(rule_engine.tick, resync=False)
         except Exception as e:
-            logging.error(f"❌ 重连失败：{e}，{delay}s 后再次尝试")
-            time.sleep(min(delay, 60))
-            delay *= 2
+            logging.error(f"❌ 定时检查失败: {e}")
 
 # -------------------------------------------------
-# 6. listening() 主函数：初始化 DB 池 + 连接 MQTT + loop_forever()
+# 6. listening() 主函数：初始化 DB 池 + 连接 MQTT + loop_start()
+#    stop_listening() 触发优雅退出
 # -------------------------------------------------
+stop_event = threading.Event()
+
+def stop_listening():
+    """请求 listening() 退出；可以在信号处理函数里调用。"""
+    health.mark_shutting_down()
+    stop_event.set()
+
+def drain(client):
+    """
+    优雅退出：先断开 MQTT 不再接收新消息，再等网络线程把正在处理的
+    on_message（即正在写入的那一批）执行完，最后关闭连接池。
+    """
+    logging.info("⏳ 正在处理剩余数据并退出...")
+    client.disconnect()
+    client.loop_stop()
+    if db_pool is not None:
+        db_pool.closeall()
+    health.set_ready("database", False)
+    logging.info("✅ listener 已退出")
+
 def listening():
     # 先初始化数据库连接池
     init_db_pool()
@@ -181,14 +382,26 @@ def listening():
     # client.username_pw_set("username", "password")
     # client.tls_set(...)
 
-    client.connect(MQTT_BROKER, MQTT_PORT, keepalive=60)
-    logging.info(f"📡 已连接 MQTT Broker {MQTT_BROKER}:{MQTT_PORT}，开始循环订阅 {TOPIC}")
-    client.loop_forever()
+    # 离线检测和 missing 规则即使没有新消息也要按时触发
+    liveness.tracker.active = True
+    threading.Thread(target=tick_loop, daemon=True).start()
+
+    # 首次连接也交给网络线程：连不上时按同样的抖动退避重试，不阻塞调用方
+    jittered_reconnect_delay(client)
+    client.connect_async(MQTT_BROKER, MQTT_PORT, keepalive=60)
+    client.loop_start()
+    logging.info(f"📡 正在连接 MQTT Broker {MQTT_BROKER}:{MQTT_PORT}，订阅 {TOPIC}")
+
+    try:
+        stop_event.wait()
+    finally:
+        drain(client)
 
 # -------------------------------------------------
 # 7. 脚本可直接独立运行或被 main.py 以线程方式调用
 # -------------------------------------------------
 if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_listening())
     try:
         listening()
     except KeyboardInterrupt:
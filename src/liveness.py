@@ -0,0 +1,163 @@
+# ==========================================
+# liveness.py — 传感器在线/离线检测
+# ==========================================
+"""
+listen.on_message 每收到一条读数就调用 tracker.seen(sensor_id)，只更新一个时间戳；
+离线检测由分层时间轮（hierarchical timer wheel）驱动，tracker.advance() 只处理
+到期的槽位，不需要周期性地扫描全部传感器。
+
+每个在线传感器在时间轮里恰好有一个条目。条目到期时，如果期间收到过新数据，
+就按最新的 last_seen 重新入轮；否则标记为离线并产生 "offline" 事件。
+离线传感器再次上报时产生 "recovered" 事件并重新入轮。
+"""
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from config import config
+
+# kind 为 "offline" 或 "recovered"
+LivenessEvent = namedtuple("LivenessEvent", ["kind", "sensor_id", "time"])
+
+
+class TimerWheel:
+    """
+    分层时间轮。第 0 层 256 个槽，每槽一个 tick（resolution 秒）；
+    之后每层 64 个槽，每槽覆盖下一层一整圈。总跨度 2^26 个 tick，
+    超出跨度的条目会放在最远的槽里，到期时再由调用方重新安排。
+    """
+
+    LEVEL_BITS = (8, 6, 6, 6)
+
+    def __init__(self, resolution=0.1, start=None):
+        self.resolution = resolution
+        self._shifts = []
+        shift = 0
+        for bits in self.LEVEL_BITS:
+            self._shifts.append(shift)
+            shift += bits
+        self._span = 1 << shift
+        self._levels = [[{} for _ in range(1 << bits)] for bits in self.LEVEL_BITS]
+        self._current = self._to_tick(time.monotonic() if start is None else start)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _to_tick(self, t):
+        return int(t / self.resolution)
+
+    def _place(self, key, expires):
+        delta = expires - self._current
+        if delta < 0:
+            expires, delta = self._current, 0
+        elif delta >= self._span:
+            expires, delta = self._current + self._span - 1, self._span - 1
+        for level, bits in enumerate(self.LEVEL_BITS):
+            shift = self._shifts[level]
+            if delta < (1 << (shift + bits)):
+                index = (expires >> shift) & ((1 << bits) - 1)
+                self._levels[level][index][key] = expires
+                return
+
+    def schedule(self, key, deadline):
+        """在 deadline（与 start 同一时钟）之后触发 key。同一个 key 只能同时安排一次。"""
+        self._place(key, self._to_tick(deadline) + 1)
+        self._size += 1
+
+    def _step(self):
+        tick = self._current
+        # 低位归零时，把上层对应槽位的条目下放到更细的层
+        for level in range(1, len(self.LEVEL_BITS)):
+            shift = self._shifts[level]
+            if tick & ((1 << shift) - 1):
+                break
+            index = (tick >> shift) & ((1 << self.LEVEL_BITS[level]) - 1)
+            slot = self._levels[level][index]
+            self._levels[level][index] = {}
+            for key, expires in slot.items():
+                self._place(key, expires)
+
+        index = tick & ((1 << self.LEVEL_BITS[0]) - 1)
+        expired = self._levels[0][index]
+        self._levels[0][index] = {}
+        self._current += 1
+        self._size -= len(expired)
+        return list(expired)
+
+    def advance(self, now):
+        """推进到 now，返回期间到期的 key 列表。"""
+        target = self._to_tick(now)
+        expired = []
+        while self._current <= target:
+            if self._size == 0:
+                self._current = target + 1
+                break
+            expired.extend(self._step())
+        return expired
+
+
+class LivenessTracker:
+    """每条消息 O(1) 的在线状态跟踪，离线判定精度为时间轮的 resolution。"""
+
+    def __init__(self, timeout=None, resolution=None, clock=time.monotonic):
+        self.timeout = float(config.LIVENESS_TIMEOUT if timeout is None else timeout)
+        self.resolution = float(config.LIVENESS_RESOLUTION if resolution is None else resolution)
+        self._clock = clock
+        self._wheel = TimerWheel(self.resolution, start=clock())
+        self._lock = threading.Lock()
+        self._last_seen = {}   # sensor_id -> 最近一次收到数据的时钟读数
+        self._offline = set()
+        # 由 listen.listening() 置为 True；API 单独运行（serve.py）时本进程没有 listener，
+        # 计数恒为 0，不能据此判断在线状态
+        self.active = False
+
+    def seen(self, sensor_id):
+        """记录一次上报；如果该传感器之前离线，返回 "recovered" 事件。"""
+        now = self._clock()
+        with self._lock:
+            known = sensor_id in self._last_seen
+            self._last_seen[sensor_id] = now
+            if known and sensor_id not in self._offline:
+                return None
+            self._wheel.schedule(sensor_id, now + self.timeout)
+            if not known:
+                return None
+            self._offline.discard(sensor_id)
+        return LivenessEvent("recovered", sensor_id, datetime.now())
+
+    def advance(self, now=None):
+        """推进时间轮，返回新产生的 "offline" 事件列表。"""
+        now = self._clock() if now is None else now
+        events = []
+        with self._lock:
+            for sensor_id in self._wheel.advance(now):
+                deadline = self._last_seen[sensor_id] + self.timeout
+                if deadline > now:
+                    self._wheel.schedule(sensor_id, deadline)
+                else:
+                    self._offline.add(sensor_id)
+                    events.append(LivenessEvent("offline", sensor_id, datetime.now()))
+        return events
+
+    def is_online(self, sensor_id):
+        """未见过的传感器返回 None。"""
+        with self._lock:
+            if sensor_id not in self._last_seen:
+                return None
+            return sensor_id not in self._offline
+
+    def counts(self):
+        with self._lock:
+            total = len(self._last_seen)
+            offline = len(self._offline)
+        return {"total": total, "online": total - offline, "offline": offline}
+
+    def offline_sensors(self):
+        with self._lock:
+            return sorted(self._offline)
+
+
+# 全局跟踪器实例：listen.py 写入，calc.py 读取（两者需在同一进程内，即经由 main.py 启动）
+tracker = LivenessTracker()
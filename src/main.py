@@ -1,49 +1,83 @@
 # main.py
 
+import signal
 import threading
-import listen      # 负责从 Broker 拉数据写数据库
-import calc        # 负责启动 Flask 服务，给前端提供 /sensor-data 接口
-import database    # 或者叫 db_manager；负责 initialize_database()
 import time
 import sys
+import health      # 记录各组件就绪状态和启动耗时
+
+# listen（paho/psycopg2）、calc（Flask）、database 都在各自线程里按需导入，
+# 模块导入与数据库迁移并行进行，不占用启动的关键路径
+
+# 优雅退出时最多等待 listener 多少秒
+SHUTDOWN_TIMEOUT = 30
+
+def run_api():
+    import calc        # 负责启动 Flask 服务，给前端提供 /sensor-data 接口
+    calc.main()
+
+def run_listener(schema_ready):
+    import listen      # 负责从 Broker 拉数据写数据库
+    # 表结构就绪之后才开始写入
+    schema_ready.wait()
+    listen.listening()
+
+def request_shutdown(*_):
+    import listen
+    listen.stop_listening()
+
+def shutdown_requested():
+    import listen
+    return listen.stop_event.is_set()
 
 def main():
     print("programme running...")
 
-    # 1. 初始化数据库
-    if not database.db_manager.initialize_database():
-        print("❌ initializing failed, programme exits")
-        return
+    # 所有组件先登记为未就绪，全部就绪时 health 记录总启动耗时
+    for component in ("schema", "database", "mqtt"):
+        health.set_ready(component, False)
 
-    # 2. 输出应用程序启动日志
-    print("💻 应用程序运行中...")
+    # 1. API 与 listener 线程先启动：Flask/paho 的导入和数据库迁移同时进行
+    #    API 在迁移期间即可响应 /healthz、/readyz
+    thread_calc = threading.Thread(target=run_api, daemon=True)
+    schema_ready = threading.Event()
+    thread_listen = threading.Thread(target=run_listener, args=(schema_ready,), daemon=True)
 
-    # 3. 启动 MQTT 监听线程
-    thread_listen = threading.Thread(target=listen.listening)
-    # （可选）让它随主线程一起退出：
-    thread_listen.daemon = True
+    # SIGTERM（docker stop / systemd）与 Ctrl+C 走同一条优雅退出路径
+    signal.signal(signal.SIGTERM, request_shutdown)
 
-    # 4. 启动 calc（Flask 服务）线程
-    thread_calc = threading.Thread(target=calc.main)
-    thread_calc.daemon = True
-
-    thread_listen.start()
     thread_calc.start()
+    thread_listen.start()
+
+    # 2. 初始化数据库：单个连接检查并执行迁移
+    started = time.perf_counter()
+    import database    # 负责 initialize_database()
+    if not database.db_manager.initialize_database():
+        print("❌ initializing failed, programme exits")
+        sys.exit(1)
+    health.record_timing("schema", time.perf_counter() - started)
+    health.set_ready("schema", True)
+    schema_ready.set()
+
+    # 3. 输出应用程序启动日志
+    print("💻 应用程序运行中...")
 
     try:
-        while True:
-            time.sleep(1)
+        while thread_listen.is_alive():
+            thread_listen.join(1)
     except KeyboardInterrupt:
         print("\n🛑 收到 Ctrl+C，正在退出…")
-        sys.exit(0)
+        request_shutdown()
 
-    # 5. 主线程若没有其它业务逻辑，可以直接一直休眠或 join
-    #    可以用 .join() 让主线程等子线程结束（不过这两个子线程本身都不会自己结束）
-    # thread_listen.join()
-    # thread_calc.join()
+    # 等 listener 把正在写入的那一批处理完
+    thread_listen.join(SHUTDOWN_TIMEOUT)
 
-    # 也可以不 join，让主线程到达末尾后保持进程存活即可
-    print("🔴 应用程序结束（主线程继续保活，子线程依旧运行）")
+    # listener 在没有收到退出请求时自己结束，说明它异常退出了，
+    # 以非零状态码退出，让 docker / systemd 能发现并重启
+    if not shutdown_requested():
+        print("❌ listener 意外退出")
+        sys.exit(1)
+    sys.exit(0)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,272 @@
+# ==========================================
+# rules.py — 告警规则引擎
+# ==========================================
+"""
+规则在启动时编译一次，之后随 listen.py 收到的每一批数据增量求值：
+每条读数只和适用于该 sensor 的规则比较，开销与新数据量成正比，与历史长度无关。
+
+支持四类规则（kind）：
+  - threshold : 单条读数越界即触发，恢复正常即关闭
+  - duration  : 连续越界超过 seconds 秒才触发
+  - rate      : 相邻两条读数的变化速率（每分钟）超过 max_per_minute 即触发
+  - missing   : 超过 timeout 秒没有收到该 sensor 的数据即触发
+
+规则可以用 sensor_ids 限定到某几个传感器（即某几株植物），不写则对所有传感器生效。
+状态变化以 AlertTransition 的形式返回，由调用方写入 alerts 表。
+"""
+import json
+import heapq
+import logging
+import math
+import operator
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from config import config
+
+OPERATORS = {
+    ">":  operator.gt,
+    ">=": operator.ge,
+    "<":  operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+}
+
+# 默认规则；可通过环境变量 ALERT_RULES_FILE 指向一个同结构的 JSON 文件覆盖
+DEFAULT_RULES = [
+    {"name": "anomaly_flag", "kind": "threshold", "metric": "is_anomaly",
+     "op": "==", "value": True, "level": "warning", "message": "检测到异常"},
+    {"name": "temperature_high", "kind": "duration", "metric": "temperature",
+     "op": ">", "value": 35, "seconds": 60, "level": "warning", "message": "温度持续过高"},
+    {"name": "soil_dry", "kind": "threshold", "metric": "soil_moisture",
+     "op": "<", "value": 200, "level": "warning", "message": "土壤过干"},
+    {"name": "humidity_jump", "kind": "rate", "metric": "humidity",
+     "max_per_minute": 20, "level": "warning", "message": "湿度变化过快"},
+    {"name": "sensor_silent", "kind": "missing", "timeout": 120,
+     "level": "critical", "message": "传感器长时间无数据"},
+]
+
+# action 为 "open" 或 "close"；time 为状态变化发生的时间
+AlertTransition = namedtuple(
+    "AlertTransition",
+    ["action", "rule_name", "sensor_id", "level", "message", "value", "time"]
+)
+
+
+class Rule:
+    """一条编译后的规则：比较函数、参数和作用范围都在构造时确定。"""
+
+    KINDS = ("threshold", "duration", "rate", "missing")
+
+    def __init__(self, spec):
+        self.name = spec["name"]
+        self.kind = spec["kind"]
+        if self.kind not in self.KINDS:
+            raise ValueError(f"未知的规则类型: {self.kind} ({self.name})")
+
+        self.metric = spec.get("metric")
+        self.level = spec.get("level", "warning")
+        self.message = spec.get("message", self.name)
+        sensor_ids = spec.get("sensor_ids")
+        self.sensor_ids = frozenset(sensor_ids) if sensor_ids else None
+
+        if self.kind in ("threshold", "duration"):
+            self.compare = OPERATORS[spec.get("op", ">")]
+            self.value = spec["value"]
+        self.seconds = float(spec.get("seconds", 0))
+        self.max_per_minute = float(spec.get("max_per_minute", 0))
+        self.timeout = float(spec.get("timeout", 0))
+
+    def applies_to(self, sensor_id):
+        return self.sensor_ids is None or sensor_id in self.sensor_ids
+
+
+def load_rules(path=None):
+    """读取规则定义：优先使用 ALERT_RULES_FILE，否则使用 DEFAULT_RULES。"""
+    path = path or config.ALERT_RULES_FILE
+    if not path:
+        return DEFAULT_RULES
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_timestamp(value):
+    """
+    读数里的 timestamp 可能是 ISO 字符串，也可能已经是 datetime。
+    统一返回本地时间的 naive datetime（与 control.py 写入、数据库 TIMESTAMP 列一致），
+    带时区（包括结尾的 Z）的时间先换算到本地时间。
+    """
+    if not isinstance(value, datetime):
+        text = str(value).strip()
+        if text.endswith(("Z", "z")):
+            text = text[:-1] + "+00:00"
+        value = datetime.fromisoformat(text)
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+
+# 数据库中均为 NOT NULL 的三个读数
+METRIC_FIELDS = ("temperature", "humidity", "soil_moisture")
+
+
+def to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "t", "yes")
+    return bool(value)
+
+
+def normalize_reading(rec):
+    """
+    把一条原始读数转换成统一格式：sensor_id 为 int，timestamp 为本地 naive datetime，
+    三个 metric 为有限的 float，is_anomaly 为 bool。缺字段或无法转换时返回 None。
+    listen.py 的实时写入和 importer.py 的批量导入共用这一套规则。
+    """
+    if not isinstance(rec, dict):
+        return None
+    try:
+        reading = {
+            "sensor_id": int(rec["sensor_id"]),
+            # 归档文件和数据库导出里的列名是 time_stamp
+            "timestamp": parse_timestamp(rec.get("timestamp") or rec["time_stamp"]),
+            "is_anomaly": to_bool(rec.get("is_anomaly", False)),
+        }
+        for field in METRIC_FIELDS:
+            reading[field] = float(rec[field])
+    except (KeyError, TypeError, ValueError):
+        return None
+    # NaN / inf 写进表里会让 AVG、分位数草图和 JSON 输出都失效
+    if not all(math.isfinite(reading[field]) for field in METRIC_FIELDS):
+        return None
+    return reading
+
+
+class RuleEngine:
+    """
+    增量求值的规则引擎。evaluate() 处理一批新读数，tick() 处理到期的 missing 规则，
+    二者都只返回发生了状态变化的 (rule, sensor)。
+    """
+
+    def __init__(self, specs=None):
+        self.rules = [Rule(s) for s in (specs if specs is not None else load_rules())]
+        self._lock = threading.Lock()
+        self._rules_for = {}   # sensor_id -> (读数规则列表, missing 规则列表)，首次见到时计算
+        self._open = set()     # 当前处于告警状态的 (rule_name, sensor_id)
+        self._since = {}       # duration 规则：(rule_name, sensor_id) -> 首次越界时间
+        self._previous = {}    # rate 规则：(rule_name, sensor_id) -> (time, value)
+        self._last_seen = {}   # missing 规则：sensor_id -> time.monotonic()
+        self._deadlines = []   # missing 规则的到期堆：(deadline, rule_name, sensor_id)
+        self._scheduled = set()  # 已在堆中的 (rule_name, sensor_id)，保证每对最多一个条目
+        self._by_name = {r.name: r for r in self.rules}
+
+    def restore(self, open_alerts):
+        """
+        以 alerts 表中未关闭的告警替换当前的告警状态：启动时用于恢复，
+        写告警失败后用于重新同步，使引擎与表保持一致。
+        """
+        with self._lock:
+            self._open = {
+                (rule_name, sensor_id) for rule_name, sensor_id in open_alerts
+                if rule_name in self._by_name
+            }
+
+    def _rules_of(self, sensor_id):
+        cached = self._rules_for.get(sensor_id)
+        if cached is None:
+            applicable = [r for r in self.rules if r.applies_to(sensor_id)]
+            cached = (
+                [r for r in applicable if r.kind != "missing"],
+                [r for r in applicable if r.kind == "missing"],
+            )
+            self._rules_for[sensor_id] = cached
+        return cached
+
+    def _set_state(self, rule, sensor_id, breached, value, when, transitions):
+        key = (rule.name, sensor_id)
+        if breached and key not in self._open:
+            self._open.add(key)
+            transitions.append(AlertTransition(
+                "open", rule.name, sensor_id, rule.level, rule.message, value, when))
+        elif not breached and key in self._open:
+            self._open.discard(key)
+            transitions.append(AlertTransition(
+                "close", rule.name, sensor_id, rule.level, rule.message, value, when))
+
+    def _check(self, rule, sensor_id, value, when):
+        """返回 True/False 表示是否越界；返回 None 表示数据不足，保持原状态。"""
+        if rule.kind == "threshold":
+            return bool(rule.compare(value, rule.value))
+
+        if rule.kind == "duration":
+            key = (rule.name, sensor_id)
+            if not rule.compare(value, rule.value):
+                self._since.pop(key, None)
+                return False
+            since = self._since.setdefault(key, when)
+            return (when - since).total_seconds() >= rule.seconds
+
+        # rate：按规则分别记录上一条读数，同一 metric 上的多条 rate 规则互不影响
+        key = (rule.name, sensor_id)
+        previous = self._previous.get(key)
+        if previous is None or when > previous[0]:
+            self._previous[key] = (when, value)
+        if previous is None or when <= previous[0]:
+            return None
+        minutes = (when - previous[0]).total_seconds() / 60
+        return abs(value - previous[1]) / minutes > rule.max_per_minute
+
+    def evaluate(self, records):
+        """对一批读数求值，返回本批产生的状态变化列表。"""
+        transitions = []
+        now = time.monotonic()
+        with self._lock:
+            for rec in records:
+                sensor_id = rec["sensor_id"]
+                try:
+                    when = parse_timestamp(rec["timestamp"])
+                except ValueError:
+                    logging.error(f"❌ 无法解析时间戳，跳过规则求值: {rec}")
+                    continue
+
+                reading_rules, missing_rules = self._rules_of(sensor_id)
+                for rule in reading_rules:
+                    value = rec.get(rule.metric)
+                    if value is None:
+                        continue
+                    breached = self._check(rule, sensor_id, value, when)
+                    if breached is not None:
+                        self._set_state(rule, sensor_id, breached, value, when, transitions)
+
+                if missing_rules:
+                    self._last_seen[sensor_id] = now
+                    for rule in missing_rules:
+                        self._set_state(rule, sensor_id, False, None, when, transitions)
+                        self._schedule(rule, sensor_id, now + rule.timeout)
+        return transitions
+
+    def _schedule(self, rule, sensor_id, deadline):
+        key = (rule.name, sensor_id)
+        if key not in self._scheduled:
+            self._scheduled.add(key)
+            heapq.heappush(self._deadlines, (deadline, rule.name, sensor_id))
+
+    def tick(self, now=None):
+        """
+        处理已到期的 missing 规则。堆里每个 (rule, sensor) 最多一个条目：
+        到期时若期间收到过新数据，就按最新的 last_seen 重新入堆，否则触发告警。
+        """
+        transitions = []
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, rule_name, sensor_id = heapq.heappop(self._deadlines)
+                self._scheduled.discard((rule_name, sensor_id))
+                rule = self._by_name[rule_name]
+                deadline = self._last_seen[sensor_id] + rule.timeout
+                if deadline > now:
+                    self._schedule(rule, sensor_id, deadline)
+                else:
+                    self._set_state(rule, sensor_id, True, None, datetime.now(), transitions)
+        return transitions
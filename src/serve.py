@@ -0,0 +1,84 @@
+# ==========================================
+# serve.py — API 的生产部署入口
+# ==========================================
+"""
+用 gunicorn 以多进程 + 多线程方式运行 calc.app：
+
+    python serve.py --workers 4 --threads 8 --bind 0.0.0.0:5000
+
+每个 worker 在 fork 之后才导入 calc，连接池和缓存都是进程私有的（shared-nothing）。
+这里只跑 API；MQTT 监听仍由 `python main.py` 或 `python listen.py` 单独运行，
+因此 /liveness 返回 503，/sensor-data 的 online 为 null，
+/readyz 返回 listener: false，并以实际查询数据库代替 listener 的状态。
+"""
+import argparse
+import sys
+
+from config import config
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="以 gunicorn 运行传感器数据 API")
+    parser.add_argument(
+        "--bind", "-b", default=f"{config.API_HOST}:{config.API_PORT}",
+        help=f"监听地址（默认 {config.API_HOST}:{config.API_PORT}）"
+    )
+    parser.add_argument(
+        "--workers", "-w", type=int, default=config.API_WORKERS,
+        help=f"worker 进程数（默认 {config.API_WORKERS}）"
+    )
+    parser.add_argument(
+        "--threads", "-t", type=int, default=config.API_THREADS,
+        help=f"每个 worker 的线程数（默认 {config.API_THREADS}）"
+    )
+    parser.add_argument(
+        "--timeout", type=int, default=30,
+        help="单个请求超时（秒）（默认 30）"
+    )
+    return parser.parse_args()
+
+
+def post_worker_init(worker):
+    """worker 启动后即可接收请求；数据库是否可用由 /readyz 每次实时检查"""
+    import health
+    health.set_ready("api", True)
+
+
+def main():
+    args = parse_args()
+    # 连接池至少要能覆盖 worker 内的全部线程（worker 在 fork 后继承这个配置）
+    config.API_DB_POOL_SIZE = max(config.API_DB_POOL_SIZE, args.threads)
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("❌ 未安装 gunicorn，请先 pip install gunicorn（仅支持 Linux/macOS）")
+        sys.exit(1)
+
+    class APIApplication(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # 在 worker 进程内导入，保证每个 worker 拥有独立的连接池
+            import calc
+            return calc.app
+
+    APIApplication({
+        "bind": args.bind,
+        "workers": args.workers,
+        "threads": args.threads,
+        "worker_class": "gthread",
+        "timeout": args.timeout,
+        "preload_app": False,
+        "post_worker_init": post_worker_init,
+        "accesslog": "-",
+    }).run()
+
+
+if __name__ == "__main__":
+    main()
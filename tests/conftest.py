@@ -0,0 +1,5 @@
+import os
+import sys
+
+# src/ 下的模块互相按文件名导入（import config、import rules ...），测试也这样导入
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,39 @@
+from datetime import datetime
+
+from dedup import RecentKeyFilter, reading_key
+
+
+def test_reading_key_matches_unique_constraint():
+    when = datetime(2025, 6, 3, 12, 0, 0)
+    assert reading_key({"sensor_id": 1, "timestamp": when, "temperature": 20}) == \
+        reading_key({"sensor_id": 1, "timestamp": when, "temperature": 30})
+    assert reading_key({"sensor_id": 1, "timestamp": when}) != reading_key({"sensor_id": 2, "timestamp": when})
+
+
+def test_filter_evicts_least_recently_used():
+    keys = RecentKeyFilter(capacity=3)
+    for key in "abcd":
+        keys.add(key)
+    assert len(keys) == 3
+    assert "a" not in keys
+    assert all(key in keys for key in "bcd")
+
+
+def test_hit_moves_key_to_end():
+    keys = RecentKeyFilter(capacity=3)
+    for key in "abc":
+        keys.add(key)
+    assert "a" in keys          # 命中后 a 变成最近使用的
+    keys.add("d")
+    assert "b" not in keys
+    assert all(key in keys for key in "acd")
+
+
+def test_adding_existing_key_refreshes_it():
+    keys = RecentKeyFilter(capacity=2)
+    keys.add("a")
+    keys.add("b")
+    keys.add("a")
+    keys.add("c")
+    assert len(keys) == 2
+    assert "a" in keys and "c" in keys and "b" not in keys
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from downsample import HistoryCache, downsample_history, lttb, minmax
+
+
+def series(size, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.cumsum(rng.uniform(0.5, 1.5, size))
+    y = np.cumsum(rng.normal(0, 1, size))
+    return x, y
+
+
+@pytest.mark.parametrize("size,n", [(10, 3), (100, 7), (1000, 50), (5000, 1999), (37, 36)])
+def test_lttb_bounds(size, n):
+    x, y = series(size, seed=size)
+    idx = lttb(x, y, n)
+    assert len(idx) == n
+    assert idx[0] == 0 and idx[-1] == size - 1
+    assert np.all(np.diff(idx) > 0)
+
+
+@pytest.mark.parametrize("size,n", [(10, 3), (100, 7), (1000, 50), (5000, 1999), (37, 36)])
+def test_minmax_bounds_and_extremes(size, n):
+    x, y = series(size, seed=size)
+    idx = minmax(x, y, n)
+    assert 0 < len(idx) <= n
+    assert np.all(np.diff(idx) > 0)
+    assert idx[0] >= 0 and idx[-1] < size
+    # 全局最小值、最大值一定会被保留
+    assert y[idx].min() == y.min() and y[idx].max() == y.max()
+
+
+@pytest.mark.parametrize("pick", [lttb, minmax])
+def test_short_series_is_returned_unchanged(pick):
+    x, y = series(5)
+    assert list(pick(x, y, 5)) == [0, 1, 2, 3, 4]
+    assert list(pick(x, y, 100)) == [0, 1, 2, 3, 4]
+
+
+def test_lttb_small_targets():
+    x, y = series(50)
+    assert list(lttb(x, y, 1)) == [0]
+    assert list(lttb(x, y, 2)) == [0, 49]
+
+
+def test_downsample_history_keeps_timestamps_aligned():
+    start = datetime(2025, 6, 3)
+    times = [start + timedelta(seconds=10 * i) for i in range(500)]
+    values = [float(i % 17) for i in range(500)]
+    result = downsample_history(times, {"temperature": values}, 40, "lttb")
+    stamps, picked = result["temperature"]
+    assert len(stamps) == len(picked) == 40
+    for stamp, value in zip(stamps, picked):
+        i = times.index(datetime.fromisoformat(stamp))
+        assert value == round(values[i], 2)
+
+
+def test_history_cache_evicts_least_recently_used():
+    cache = HistoryCache(capacity=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from fleet import DDSketch, FleetStats
+
+QUANTILES = [0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1]
+
+
+def assert_relative_error(sketch, values, alpha):
+    ordered = np.sort(values)
+    for q in QUANTILES:
+        # 草图返回排序后第 floor(q*(n-1)) 个值的估计
+        exact = ordered[int(q * (len(ordered) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= alpha * abs(exact) + 1e-12
+
+
+@pytest.mark.parametrize("alpha", [0.01, 0.05])
+def test_sketch_quantiles_within_alpha(alpha):
+    rng = np.random.default_rng(7)
+    values = np.concatenate([
+        rng.lognormal(3, 1, 5000),
+        -rng.lognormal(1, 0.5, 1000),
+        np.zeros(200),
+    ])
+    sketch = DDSketch(alpha)
+    sketch.add(values)
+    assert sketch.count == len(values)
+    assert_relative_error(sketch, values, alpha)
+
+
+def test_merged_sketches_keep_the_guarantee():
+    rng = np.random.default_rng(11)
+    values = rng.uniform(1, 1000, 4000)
+    parts = [DDSketch(0.01) for _ in range(4)]
+    for part, chunk in zip(parts, np.array_split(values, 4)):
+        part.add(chunk)
+    merged = DDSketch(0.01)
+    for part in parts:
+        merged.merge(part)
+    assert merged.count == len(values)
+    assert_relative_error(merged, values, 0.01)
+
+
+def test_sketch_ignores_nan_and_handles_empty():
+    sketch = DDSketch(0.01)
+    assert sketch.quantile(0.5) is None
+    sketch.add(np.array([np.nan, 5.0]))
+    assert sketch.count == 1
+    assert abs(sketch.quantile(0.5) - 5.0) <= 0.05
+
+
+def reading(when, temperature, is_anomaly=False):
+    return {"timestamp": when, "temperature": temperature, "humidity": 50.0,
+            "soil_moisture": 500.0, "is_anomaly": is_anomaly}
+
+
+T0 = datetime(2025, 6, 3, 12, 0, 0)
+
+
+def test_summary_merges_buckets_in_window():
+    stats = FleetStats(retention=60, alpha=0.01)
+    stats.add_batch([reading(T0 + timedelta(minutes=m, seconds=s), 20 + m, is_anomaly=(s == 0))
+                     for m in range(10) for s in (0, 30)])
+    result = stats.summary(5)
+    assert result["end"] == (T0 + timedelta(minutes=10)).isoformat()
+    assert result["readings"] == 10
+    assert result["anomaly_rate"] == 0.5
+    temperature = result["metrics"]["temperature"]
+    assert (temperature["min"], temperature["max"]) == (25, 29)
+    assert temperature["mean"] == pytest.approx(27)
+
+
+def test_coverage_starts_after_first_live_bucket():
+    stats = FleetStats(retention=5, alpha=0.01)
+    stats.add_batch([reading(T0 + timedelta(seconds=30), 20)])
+    # 第一个桶只收到了一部分数据，完整覆盖从它的末尾开始
+    assert stats.coverage() == (T0 + timedelta(minutes=1), T0 + timedelta(minutes=1))
+    # 迟到的旧读数不会把覆盖起点提前
+    stats.add_batch([reading(T0 - timedelta(minutes=3), 20)])
+    assert stats.coverage()[0] == T0 + timedelta(minutes=1)
+    # 超过保留期后，起点跟着最早保留的桶走
+    for m in range(1, 10):
+        stats.add_batch([reading(T0 + timedelta(minutes=m), 20)])
+    assert stats.coverage() == (T0 + timedelta(minutes=5), T0 + timedelta(minutes=10))
@@ -0,0 +1,71 @@
+import io
+import json
+
+import pytest
+
+from importer import iter_json_array, iter_records, normalize
+
+DOCUMENT = """
+[
+  {"sensor_id": 1, "timestamp": "2025-06-03T12:00:00", "note": "a, [b] {c}"},
+  12345,  -6.5e-3 ,"tail\\"quote]",
+  [{"sensor_id": 2}, {"sensor_id": 3}],
+  true, null, {"nested": {"deep": [1, 2, [3]]}}
+]
+"""
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 16, 1 << 16])
+def test_json_array_across_chunk_boundaries(chunk_size):
+    items = list(iter_json_array(io.StringIO(DOCUMENT), chunk_size=chunk_size))
+    assert items == json.loads(DOCUMENT)
+
+
+@pytest.mark.parametrize("document", ["[]", "  [ ]  ", "[1]", "[ 1 , 2 ]"])
+def test_json_array_small_documents(document):
+    assert list(iter_json_array(io.StringIO(document), chunk_size=1)) == json.loads(document)
+
+
+def test_json_array_rejects_truncated_document():
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(io.StringIO('[{"a": 1}, {"b": '), chunk_size=4))
+
+
+def test_json_array_bounds_buffer_after_malformed_element():
+    stream = io.StringIO('[{"a": 1}, {"b": ' + "x" * 10000 + "}]")
+    items = iter_json_array(stream, chunk_size=64, max_buffer=1000)
+    assert next(items) == {"a": 1}
+    with pytest.raises(ValueError, match="1000"):
+        next(items)
+    # 没有把剩下的内容全部读进内存
+    assert stream.tell() < 2000
+
+
+def test_normalize_formats_timestamp_for_csv():
+    row = normalize({"sensor_id": "3", "timestamp": "2025-06-03T14:59:42,5",
+                     "temperature": "36.5", "humidity": 40, "soil_moisture": 512,
+                     "is_anomaly": "false"})
+    assert row == (3, "2025-06-03T14:59:42.500000", 36.5, 40.0, 512.0, False)
+
+
+@pytest.mark.parametrize("rec", [
+    {"timestamp": "2025-06-03T12:00:00", "temperature": 1, "humidity": 1, "soil_moisture": 1},
+    {"sensor_id": 1, "timestamp": "2025-06-03T12:00:00", "temperature": "nan", "humidity": 1,
+     "soil_moisture": 1},
+    {"sensor_id": 1, "timestamp": "2025-06-03T12:00:00", "temperature": 1, "humidity": "inf",
+     "soil_moisture": 1},
+    "not a record",
+    {"sensor_id": 1, "timestamp": "yesterday", "temperature": 1, "humidity": 1, "soil_moisture": 1},
+    {"sensor_id": 1, "timestamp": "2025-06-03T12:00:00", "temperature": None, "humidity": 1,
+     "soil_moisture": 1},
+])
+def test_normalize_rejects_invalid_rows(rec):
+    assert normalize(rec) is None
+
+
+def test_csv_with_bom_and_time_stamp_column(tmp_path):
+    path = tmp_path / "export.csv"
+    path.write_text("sensor_id,time_stamp,temperature,humidity,soil_moisture,is_anomaly\n"
+                    "1,2025-06-03 12:00:00,20,40,512,0\n", encoding="utf-8-sig")
+    rows = [normalize(rec) for rec in iter_records(str(path))]
+    assert rows == [(1, "2025-06-03T12:00:00", 20.0, 40.0, 512.0, False)]
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("paho.mqtt.client")
+import listen   # noqa: E402
+
+T0 = datetime(2025, 6, 3, 12, 0, 0)
+
+
+class FakeCursor:
+    def close(self):
+        pass
+
+
+class FakeConn:
+    def __init__(self):
+        self.committed = False
+        self.rolled_back = False
+
+    def cursor(self):
+        return FakeCursor()
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+class FakePool:
+    def __init__(self):
+        self.conn = FakeConn()
+        self.returned = False
+
+    def getconn(self):
+        return self.conn
+
+    def putconn(self, conn):
+        self.returned = True
+
+
+def reading(sensor_id, seconds):
+    return listen.normalize_reading({
+        "sensor_id": sensor_id, "timestamp": (T0 + timedelta(seconds=seconds)).isoformat(),
+        "temperature": 20, "humidity": 50, "soil_moisture": 500,
+    })
+
+
+def test_save_batch_returns_only_rows_reported_by_returning(monkeypatch):
+    pool = FakePool()
+    batch = [reading(1, 0), reading(1, 10), reading(2, 0)]
+    sent = []
+
+    def fake_execute_values(cursor, sql, rows, page_size, fetch):
+        assert "RETURNING sensor_id, time_stamp" in sql and fetch
+        assert page_size == len(rows)
+        sent.extend(rows)
+        # 数据库里已有 (1, T0+10s)，ON CONFLICT 跳过，RETURNING 只返回另外两行
+        return [(1, T0), (2, T0)]
+
+    monkeypatch.setattr(listen, "db_pool", pool)
+    monkeypatch.setattr(listen, "execute_values", fake_execute_values)
+    inserted = listen.save_batch_to_db(batch)
+    assert len(sent) == 3
+    assert inserted == [batch[0], batch[2]]
+    assert pool.conn.committed and pool.returned
+
+
+def test_save_batch_returns_none_on_failure(monkeypatch):
+    pool = FakePool()
+
+    def failing_execute_values(*args, **kwargs):
+        raise listen.psycopg2.OperationalError("connection lost")
+
+    monkeypatch.setattr(listen, "db_pool", pool)
+    monkeypatch.setattr(listen, "execute_values", failing_execute_values)
+    assert listen.save_batch_to_db([reading(1, 0)]) is None
+    assert pool.conn.rolled_back and pool.returned
+
+
+@pytest.mark.parametrize("field,value", [
+    ("temperature", "nan"), ("humidity", "inf"), ("soil_moisture", None), ("sensor_id", "x"),
+    ("timestamp", "yesterday"),
+])
+def test_normalize_reading_rejects_invalid_values(field, value):
+    rec = {"sensor_id": 1, "timestamp": T0.isoformat(), "temperature": 20,
+           "humidity": 50, "soil_moisture": 500}
+    rec[field] = value
+    assert listen.normalize_reading(rec) is None
+
+
+def test_normalize_reading_converts_types():
+    reading = listen.normalize_reading({
+        "sensor_id": "3", "timestamp": "2025-06-03T12:00:00", "temperature": "36.5",
+        "humidity": 40, "soil_moisture": 512, "is_anomaly": "true",
+    })
+    assert reading == {"sensor_id": 3, "timestamp": T0, "temperature": 36.5, "humidity": 40.0,
+                       "soil_moisture": 512.0, "is_anomaly": True}
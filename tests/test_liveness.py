@@ -0,0 +1,48 @@
+import random
+
+from liveness import LivenessTracker, TimerWheel
+
+
+def test_timer_wheel_matches_brute_force():
+    rng = random.Random(20250603)
+    wheel = TimerWheel(resolution=1.0, start=0)
+    expected = {}   # key -> 应到期的 tick（暴力模型）
+    current = 0     # 下一个尚未处理的 tick
+    next_key = 0
+    for _ in range(2000):
+        # 随机安排一批新条目，跨度覆盖时间轮的前三层，也包括已经过去的 deadline
+        for _ in range(rng.randint(0, 5)):
+            deadline = current + rng.choice([rng.randint(-5, 300), rng.randint(0, 20000), rng.randint(0, 400000)])
+            wheel.schedule(next_key, deadline)
+            expected[next_key] = max(deadline + 1, current)
+            next_key += 1
+        now = current + rng.choice([0, 1, rng.randint(1, 50), rng.randint(1, 5000)])
+        fired = wheel.advance(now)
+        due = {key for key, tick in expected.items() if tick <= now}
+        assert sorted(fired) == sorted(due)
+        for key in due:
+            del expected[key]
+        current = now + 1
+        assert len(wheel) == len(expected)
+
+
+def test_tracker_reports_offline_and_recovered():
+    clock = [0.0]
+    tracker = LivenessTracker(timeout=10, resolution=0.5, clock=lambda: clock[0])
+    assert tracker.is_online(1) is None
+    assert tracker.seen(1) is None
+    assert tracker.seen(2) is None
+
+    clock[0] = 6
+    tracker.seen(1)
+    clock[0] = 11
+    events = tracker.advance()
+    assert [(e.kind, e.sensor_id) for e in events] == [("offline", 2)]
+    assert tracker.is_online(1) and not tracker.is_online(2)
+    assert tracker.counts() == {"total": 2, "online": 1, "offline": 1}
+
+    clock[0] = 17
+    assert [(e.kind, e.sensor_id) for e in tracker.advance()] == [("offline", 1)]
+    event = tracker.seen(2)
+    assert (event.kind, event.sensor_id) == ("recovered", 2)
+    assert tracker.offline_sensors() == [1]
@@ -0,0 +1,101 @@
+import time
+from datetime import datetime, timedelta
+
+from rules import RuleEngine, parse_timestamp
+
+T0 = datetime(2025, 6, 3, 12, 0, 0)
+
+
+def reading(sensor_id=1, minutes=0, **metrics):
+    return dict({"sensor_id": sensor_id, "timestamp": T0 + timedelta(minutes=minutes)}, **metrics)
+
+
+def actions(transitions):
+    return [(t.action, t.rule_name, t.sensor_id) for t in transitions]
+
+
+def test_threshold_opens_once_and_closes():
+    engine = RuleEngine([{"name": "soil_dry", "kind": "threshold", "metric": "soil_moisture",
+                          "op": "<", "value": 200}])
+    assert actions(engine.evaluate([reading(soil_moisture=150)])) == [("open", "soil_dry", 1)]
+    assert engine.evaluate([reading(minutes=1, soil_moisture=100)]) == []
+    assert actions(engine.evaluate([reading(minutes=2, soil_moisture=300)])) == [("close", "soil_dry", 1)]
+    assert engine.evaluate([reading(minutes=3, soil_moisture=300)]) == []
+
+
+def test_rules_are_tracked_per_sensor():
+    engine = RuleEngine([{"name": "hot", "kind": "threshold", "metric": "temperature",
+                          "op": ">", "value": 35, "sensor_ids": [2]}])
+    assert engine.evaluate([reading(1, temperature=40)]) == []
+    assert actions(engine.evaluate([reading(2, temperature=40)])) == [("open", "hot", 2)]
+
+
+def test_duration_needs_continuous_breach():
+    engine = RuleEngine([{"name": "hot", "kind": "duration", "metric": "temperature",
+                          "op": ">", "value": 35, "seconds": 120}])
+    assert engine.evaluate([reading(temperature=40), reading(minutes=1, temperature=40)]) == []
+    # 中途恢复正常会重新计时
+    assert engine.evaluate([reading(minutes=2, temperature=30)]) == []
+    assert engine.evaluate([reading(minutes=3, temperature=40)]) == []
+    assert actions(engine.evaluate([reading(minutes=5, temperature=40)])) == [("open", "hot", 1)]
+    assert actions(engine.evaluate([reading(minutes=6, temperature=30)])) == [("close", "hot", 1)]
+
+
+def test_two_rate_rules_on_the_same_metric():
+    engine = RuleEngine([
+        {"name": "humidity_fast", "kind": "rate", "metric": "humidity", "max_per_minute": 10},
+        {"name": "humidity_slow", "kind": "rate", "metric": "humidity", "max_per_minute": 1},
+    ])
+    assert engine.evaluate([reading(humidity=50)]) == []
+    # +5/分钟：只超过 slow 的阈值
+    assert actions(engine.evaluate([reading(minutes=1, humidity=55)])) == [("open", "humidity_slow", 1)]
+    # +20/分钟：fast 也打开
+    assert actions(engine.evaluate([reading(minutes=2, humidity=75)])) == [("open", "humidity_fast", 1)]
+    # 不再变化：两条规则都关闭
+    assert sorted(actions(engine.evaluate([reading(minutes=3, humidity=75)]))) == [
+        ("close", "humidity_fast", 1), ("close", "humidity_slow", 1)]
+
+
+def test_rate_ignores_out_of_order_readings():
+    engine = RuleEngine([{"name": "jump", "kind": "rate", "metric": "humidity", "max_per_minute": 1}])
+    engine.evaluate([reading(minutes=5, humidity=50)])
+    assert engine.evaluate([reading(minutes=1, humidity=90)]) == []
+    assert engine.evaluate([reading(minutes=6, humidity=50.5)]) == []
+
+
+def test_missing_opens_on_tick_and_closes_on_next_reading():
+    engine = RuleEngine([{"name": "silent", "kind": "missing", "timeout": 60}])
+    assert engine.evaluate([reading(temperature=20)]) == []
+    assert engine.tick(time.monotonic() + 30) == []
+    assert actions(engine.tick(time.monotonic() + 61)) == [("open", "silent", 1)]
+    # 已经打开的告警不会重复打开
+    assert engine.tick(time.monotonic() + 200) == []
+    assert actions(engine.evaluate([reading(minutes=5, temperature=20)])) == [("close", "silent", 1)]
+
+
+def test_restore_lets_recovered_sensor_close_alert():
+    engine = RuleEngine([{"name": "soil_dry", "kind": "threshold", "metric": "soil_moisture",
+                          "op": "<", "value": 200}])
+    engine.restore([("soil_dry", 1), ("unknown_rule", 1)])
+    assert actions(engine.evaluate([reading(soil_moisture=500)])) == [("close", "soil_dry", 1)]
+
+
+def test_parse_timestamp_returns_naive_local_time():
+    assert parse_timestamp("2025-06-03T12:00:00") == T0
+    assert parse_timestamp(T0) is T0
+    utc = parse_timestamp("2025-06-03T12:00:00Z")
+    assert utc.tzinfo is None
+    assert utc == datetime.fromisoformat("2025-06-03T12:00:00+00:00").astimezone().replace(tzinfo=None)
+
+
+def test_restore_replaces_state_after_lost_writes():
+    engine = RuleEngine([{"name": "soil_dry", "kind": "threshold", "metric": "soil_moisture",
+                          "op": "<", "value": 200}])
+    # 引擎认为告警已打开，但 open 没写进表：按表重新同步后，仍越界的读数会再次打开它
+    engine.evaluate([reading(soil_moisture=100)])
+    engine.restore([])
+    assert actions(engine.evaluate([reading(minutes=1, soil_moisture=100)])) == [("open", "soil_dry", 1)]
+    # close 没写进表：表中仍是打开的，恢复正常的读数会再次关闭它
+    engine.evaluate([reading(minutes=2, soil_moisture=500)])
+    engine.restore([("soil_dry", 1)])
+    assert actions(engine.evaluate([reading(minutes=3, soil_moisture=500)])) == [("close", "soil_dry", 1)]